@@ -0,0 +1,263 @@
+"""
+Benchmarks the OpenID store and views against SQLite and an in-process
+stand-in OpenID provider.
+
+* Store operations per second (storeAssociation, getAssociation, useNonce,
+  cleanupNonces, cleanupAssociations) as the association and nonce tables
+  grow. With the lookup indexes in place lookups should stay flat.
+* End-to-end latency of the Begin and Callback views through the Django test
+  client: discovery, association, the provider's positive assertion and its
+  verification.
+
+Results are written as JSON to stdout (or to ``--output``), a summary is
+printed on stderr. Run it from the repository root::
+
+    PYTHONPATH=. DJANGO_SETTINGS_MODULE=le_social.test_settings \\
+        python benchmarks/bench_openid.py --sizes 1000,10000 > openid.json
+"""
+from __future__ import division, print_function
+
+import random
+import sys
+import time
+
+try:
+    from urllib.parse import parse_qsl, urlparse
+except ImportError:
+    from urlparse import parse_qsl, urlparse
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from common import format_stats, get_parser, setup, stats, write_results
+
+PROVIDER = 'http://provider.example.com'
+ENDPOINT = PROVIDER + '/server'
+XRDS = """<?xml version="1.0" encoding="UTF-8"?>
+<xrds:XRDS xmlns:xrds="xri://$xrds" xmlns="xri://$xrd*($v*2.0)">
+  <XRD>
+    <Service priority="0">
+      <Type>http://specs.openid.net/auth/2.0/signon</Type>
+      <URI>%s</URI>
+    </Service>
+  </XRD>
+</xrds:XRDS>""" % ENDPOINT
+
+urlpatterns = []
+
+
+def server_url(i):
+    return 'https://openid.example.com/%d/server' % i
+
+
+def fill(size):
+    """
+    Adds live associations and nonces until both tables hold ``size`` rows.
+    """
+    from le_social.openid.models import Association, Nonce, hash_server_url
+
+    now = int(time.time())
+    start = Association.objects.count()
+    Association.objects.bulk_create([
+        Association(server_url=server_url(i),
+                    server_url_hash=hash_server_url(server_url(i)),
+                    handle='handle', secret='c2VjcmV0', issued=now,
+                    lifetime=3600, assoc_type='HMAC-SHA1')
+        for i in range(start, size)
+    ], batch_size=500)
+    start = Nonce.objects.count()
+    Nonce.objects.bulk_create([
+        Nonce(server_url=server_url(i), timestamp=now, salt='salt')
+        for i in range(start, size)
+    ], batch_size=500)
+
+
+def add_expired(count):
+    from openid.store.nonce import SKEW
+    from le_social.openid.models import Association, Nonce, hash_server_url
+
+    now = int(time.time())
+    Association.objects.bulk_create([
+        Association(server_url=server_url(i),
+                    server_url_hash=hash_server_url(server_url(i)),
+                    handle='expired', secret='c2VjcmV0', issued=now - 7200,
+                    lifetime=3600, assoc_type='HMAC-SHA1')
+        for i in range(count)
+    ], batch_size=500)
+    Nonce.objects.bulk_create([
+        Nonce(server_url=server_url(i), timestamp=now - SKEW - 60,
+              salt='expired')
+        for i in range(count)
+    ], batch_size=500)
+
+
+def rate(func, count):
+    start = time.time()
+    func()
+    return count / (time.time() - start)
+
+
+def bench_store(sizes, operations):
+    from openid.association import Association as OIDAssociation
+    from le_social.openid.store import DjangoOpenIDStore
+
+    store = DjangoOpenIDStore()
+    results = []
+    for size in sizes:
+        fill(size)
+        urls = [server_url(random.randrange(size)) for _ in range(operations)]
+        now = int(time.time())
+        result = {'rows': size}
+
+        def store_associations():
+            for i in range(operations):
+                store.storeAssociation(
+                    'https://new.example.com/%d/%d' % (size, i),
+                    OIDAssociation.fromExpiresIn(3600, 'handle', b'secret',
+                                                 'HMAC-SHA1'))
+        result['storeAssociation'] = rate(store_associations, operations)
+
+        def get_associations():
+            for url in urls:
+                store.getAssociation(url, 'handle')
+        result['getAssociation'] = rate(get_associations, operations)
+
+        def use_nonces():
+            for i, url in enumerate(urls):
+                store.useNonce(url, now, 'bench-%d' % i)
+        result['useNonce'] = rate(use_nonces, operations)
+
+        add_expired(operations)
+        result['cleanupNonces'] = rate(store.cleanupNonces, operations)
+        result['cleanupAssociations'] = rate(store.cleanupAssociations,
+                                             operations)
+        results.append(result)
+    return results
+
+
+def get_provider():
+    """
+    Returns a python-openid fetcher that answers discovery and association
+    requests with an in-process OpenID server, and a function turning the
+    redirect to the provider into the provider's positive assertion.
+    """
+    from openid import fetchers
+    from openid.server.server import Server
+    from openid.store.memstore import MemoryStore
+
+    server = Server(MemoryStore(), ENDPOINT)
+
+    class Provider(fetchers.HTTPFetcher):
+        def fetch(self, url, body=None, headers=None):
+            if url == ENDPOINT:
+                request = server.decodeRequest(dict(parse_qsl(body)))
+                response = server.encodeResponse(
+                    server.handleRequest(request))
+                return fetchers.HTTPResponse(url, response.code, {},
+                                             response.body)
+            return fetchers.HTTPResponse(
+                url, 200, {'content-type': 'application/xrds+xml'}, XRDS)
+
+    def authorize(redirect_url):
+        query = dict(parse_qsl(urlparse(redirect_url).query))
+        request = server.decodeRequest(query)
+        response = server.encodeResponse(request.answer(True))
+        return response.headers['location']
+
+    return Provider(), authorize
+
+
+def bench_views(requests, stateless=False):
+    from django.conf.urls import url
+    from django.test import Client
+    from openid import fetchers
+    from le_social.openid import views
+
+    provider, authorize = get_provider()
+    # The views wrap it with their circuit breakers
+    fetchers.setDefaultFetcher(provider, wrap_exceptions=False)
+
+    class ProviderMixin(object):
+        def failure(self, message):
+            return HttpResponse(message, status=400)
+
+    ProviderMixin.stateless = stateless
+
+    class Begin(ProviderMixin, views.Begin):
+        return_url = '/complete/'
+
+    class Callback(ProviderMixin, views.Callback):
+        return_url = '/complete/'
+
+        def success(self):
+            return HttpResponse('ok')
+
+    urlpatterns[:] = [
+        url(r'^begin/$', Begin.as_view()),
+        url(r'^complete/$', Callback.as_view()),
+    ]
+    settings.ROOT_URLCONF = __name__
+    if not stateless:
+        # python-openid keeps its discovery state in the session as objects
+        settings.SESSION_SERIALIZER = (
+            'django.contrib.sessions.serializers.PickleSerializer')
+
+    begin = []
+    callback = []
+    for i in range(requests):
+        client = Client()
+        start = time.time()
+        response = client.post('/begin/', {
+            'openid_url': '%s/id/%d' % (PROVIDER, i),
+        })
+        begin.append(time.time() - start)
+        if response.status_code != 302:
+            raise RuntimeError(response.content)
+
+        return_url = urlparse(authorize(response['Location']))
+        start = time.time()
+        response = client.get(return_url.path + '?' + return_url.query)
+        callback.append(time.time() - start)
+        if response.status_code != 200:
+            raise RuntimeError(response.content)
+    return {'Begin': stats(begin), 'Callback': stats(callback)}
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma-separated table sizes.')
+    parser.add_argument('--operations', type=int, default=1000,
+                        help='Store operations per size.')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Begin/Callback round trips.')
+    parser.add_argument('--stateless', action='store_true',
+                        help='Keep the consumer state in the cache instead '
+                             'of the session.')
+    args = parser.parse_args()
+    setup()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {
+        'store': bench_store(sizes, args.operations),
+        'stateless': args.stateless,
+        'views': bench_views(args.requests, args.stateless),
+    }
+
+    print('%10s %18s %18s %18s %18s %20s' % (
+        'rows', 'storeAssociation/s', 'getAssociation/s', 'useNonce/s',
+        'cleanupNonces/s', 'cleanupAssociations/s'), file=sys.stderr)
+    for result in results['store']:
+        print('%10d %18.0f %18.0f %18.0f %18.0f %20.0f' % (
+            result['rows'], result['storeAssociation'],
+            result['getAssociation'], result['useNonce'],
+            result['cleanupNonces'], result['cleanupAssociations']),
+            file=sys.stderr)
+    for view, result in sorted(results['views'].items()):
+        print(format_stats(view, result), file=sys.stderr)
+
+    write_results('openid', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmarks registration and activation against SQLite, with the locmem
+email backend.
+
+* Registrations per second and latency of the Register view through the
+  Django test client, and of the Activate view for the registered users.
+* Latency of each stage of a registration: form validation, user creation
+  (including password hashing), activation key signing, building the
+  notification with ``Register.build_notification()`` and sending it.
+
+Password hashing usually dominates, ``--hasher`` swaps the hasher to see the
+cost of everything else, ``--html`` adds an HTML version to the
+notification. Results are written as JSON to stdout (or to
+``--output``), a summary is printed on stderr. Run it from the repository
+root::
+
+    PYTHONPATH=. DJANGO_SETTINGS_MODULE=le_social.test_settings \\
+        python benchmarks/bench_registration.py > registration.json
+"""
+from __future__ import division, print_function
+
+import sys
+import time
+
+from django.conf import settings
+
+from common import format_stats, get_parser, setup, stats, write_results
+
+
+def get_data(prefix, i):
+    return {
+        'username': '%s%d' % (prefix, i),
+        'email': '%s%d@example.com' % (prefix, i),
+        'password1': 'secret',
+        'password2': 'secret',
+    }
+
+
+HTML_TEMPLATE = 'le_social/registration/activation_email.html'
+
+
+def bench_views(registrations, html=False):
+    from django.core import mail
+    from django.test import Client
+    try:
+        from django.urls import reverse
+    except ImportError:
+        from django.core.urlresolvers import reverse
+
+    client = Client()
+    url = reverse('registration_register_with_html' if html else
+                  'registration_register')
+    register = []
+    for i in range(registrations):
+        start = time.time()
+        response = client.post(url, get_data('view', i))
+        register.append(time.time() - start)
+        if response.status_code != 302:
+            raise RuntimeError(response.content)
+
+    activate = []
+    for message in mail.outbox[-registrations:]:
+        url = [line for line in message.body.split()
+               if '/activate/' in line][0]
+        start = time.time()
+        response = client.get(url)
+        activate.append(time.time() - start)
+        if response.status_code != 302:
+            raise RuntimeError(response.content)
+
+    return {
+        'registrations_per_second': registrations / sum(register),
+        'Register': stats(register),
+        'Activate': stats(activate),
+    }
+
+
+def bench_stages(registrations, html=False):
+    from django.test import RequestFactory
+    from le_social.registration.utils import make_activation_key
+    from le_social.registration.views import Register
+
+    stages = ('validate', 'save', 'sign', 'render', 'send')
+    durations = dict((stage, []) for stage in stages)
+    factory = RequestFactory()
+    for i in range(registrations):
+        view = Register(
+            notification_html_template_name=HTML_TEMPLATE if html else None)
+        view.request = factory.post('/register/')
+        timings = [time.time()]
+
+        form = view.get_form_class()(get_data('stage', i))
+        if not form.is_valid():
+            raise RuntimeError(form.errors)
+        timings.append(time.time())
+
+        view.user = form.save()
+        timings.append(time.time())
+
+        view.activation_key = make_activation_key(view.user)
+        timings.append(time.time())
+
+        message = view.build_notification()
+        timings.append(time.time())
+
+        view.get_delivery().send(message)
+        timings.append(time.time())
+
+        for stage, start, end in zip(stages, timings, timings[1:]):
+            durations[stage].append(end - start)
+    return dict((stage, stats(durations[stage])) for stage in stages)
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument('--registrations', type=int, default=200,
+                        help='Number of registrations.')
+    parser.add_argument('--hasher',
+                        help='Password hasher to use, e.g. django.contrib.'
+                             'auth.hashers.MD5PasswordHasher')
+    parser.add_argument('--html', action='store_true',
+                        help='Send notifications with an HTML version.')
+    args = parser.parse_args()
+    if args.hasher:
+        settings.PASSWORD_HASHERS = [args.hasher]
+    setup()
+    settings.ROOT_URLCONF = 'le_social.registration.tests.urls'
+
+    results = {
+        'hasher': settings.PASSWORD_HASHERS[0],
+        'html': args.html,
+        'views': bench_views(args.registrations, args.html),
+        'stages': bench_stages(args.registrations, args.html),
+    }
+
+    views = results['views']
+    print('%.1f registrations/s' % views['registrations_per_second'],
+          file=sys.stderr)
+    for name in ('Register', 'Activate'):
+        print(format_stats(name, views[name]), file=sys.stderr)
+    for stage in ('validate', 'save', 'sign', 'render', 'send'):
+        print(format_stats('  ' + stage, results['stages'][stage]),
+              file=sys.stderr)
+
+    write_results('registration', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import platform
+import time
+
+import django
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+
+def get_parser(doc):
+    parser = argparse.ArgumentParser(description=doc.split('\n\n')[0])
+    parser.add_argument('--output', help='Write the results to this file.')
+    return parser
+
+
+def setup():
+    """
+    Sets Django up with a fresh test database and the locmem email backend.
+    """
+    django.setup()
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def stats(durations):
+    """
+    Summarizes a list of durations, in seconds, in milliseconds.
+    """
+    durations = sorted(durations)
+    count = len(durations)
+    return {
+        'count': count,
+        'mean_ms': sum(durations) / count * 1000,
+        'median_ms': durations[count // 2] * 1000,
+        'p95_ms': durations[int(count * 0.95)] * 1000,
+        'max_ms': durations[-1] * 1000,
+    }
+
+
+def format_stats(name, result):
+    return '%s: %.2fms mean, %.2fms median, %.2fms p95' % (
+        name, result['mean_ms'], result['median_ms'], result['p95_ms'])
+
+
+def write_results(name, results, output=None):
+    """
+    Writes the results as JSON, along with the environment they were
+    measured in.
+    """
+    results = dict(results, **{
+        'benchmark': name,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    })
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
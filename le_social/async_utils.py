@@ -0,0 +1,64 @@
+"""
+Helpers shared by the async views. Requires Python 3.7+ and Django 3.1+.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(max_workers):
+    """
+    Returns a process-wide thread pool of max_workers threads.
+    """
+    with _executors_lock:
+        if max_workers not in _executors:
+            _executors[max_workers] = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='le_social',
+            )
+        return _executors[max_workers]
+
+
+def call_and_close_connections(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class ThreadPoolMixin(object):
+    """
+    Async views running their blocking work in a bounded thread pool.
+    """
+    max_workers = 10
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        return async_view
+
+    async def run_in_pool(self, func, *args, **kwargs):
+        """
+        Runs func in the thread pool, with the current context (active
+        translation, etc.).
+        """
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, call_and_close_connections,
+                                 func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(self.max_workers), call)
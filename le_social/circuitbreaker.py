@@ -0,0 +1,49 @@
+from .utils import CacheMixin
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(CacheMixin):
+    """
+    Keeps track of the failures of an external provider in Django's cache,
+    so that every process shares the same state.
+
+    After ``failure_threshold`` consecutive failures the circuit opens: calls
+    to the provider should fail immediately for ``recovery_timeout`` seconds.
+    The next call is then let through, another failure re-opens the circuit
+    and a success closes it.
+    """
+    key_prefix = 'le_social.circuit'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30,
+                 cache_alias='default'):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.cache_alias = cache_alias
+
+    @property
+    def failures_key(self):
+        return '%s:%s:failures' % (self.key_prefix, self.name)
+
+    @property
+    def open_key(self):
+        return '%s:%s:open' % (self.key_prefix, self.name)
+
+    def is_open(self):
+        return self.cache.get(self.open_key) is not None
+
+    def record_failure(self):
+        self.cache.add(self.failures_key, 0, None)
+        try:
+            failures = self.cache.incr(self.failures_key)
+        except ValueError:  # Evicted in the meantime
+            failures = 1
+            self.cache.set(self.failures_key, failures, None)
+        if failures >= self.failure_threshold:
+            self.cache.set(self.open_key, True, self.recovery_timeout)
+
+    def record_success(self):
+        self.cache.delete(self.failures_key)
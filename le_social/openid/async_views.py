@@ -0,0 +1,26 @@
+"""
+Async versions of the OpenID views, for Django 3.1+ served over ASGI.
+
+python-openid is blocking: discovery, association and response verification
+all do network and database I/O. The views below run that work in a bounded
+thread pool so that a slow provider doesn't block the event loop. The store
+is called by python-openid from the pool threads.
+"""
+from ..async_utils import ThreadPoolMixin
+from . import views
+
+
+class Begin(ThreadPoolMixin, views.Begin):
+    async def get(self, request, *args, **kwargs):
+        return await self.run_in_pool(super().get, request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        return await self.run_in_pool(super().post, request, *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+
+class Callback(ThreadPoolMixin, views.Callback):
+    async def get(self, request, *args, **kwargs):
+        return await self.run_in_pool(super().get, request, *args, **kwargs)
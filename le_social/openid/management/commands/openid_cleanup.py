@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...store import DjangoOpenIDStore
+
+
+class Command(BaseCommand):
+    help = "Deletes expired OpenID nonces and associations in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help="Number of rows to delete per statement (default: 1000).")
+        parser.add_argument(
+            '--sleep', type=float, default=0, dest='sleep',
+            help="Seconds to wait between two batches (default: 0).")
+
+    def handle(self, *args, **options):
+        store = DjangoOpenIDStore()
+        for name, cleanup in (('nonces', store.cleanupNonces),
+                              ('associations', store.cleanupAssociations)):
+            start = time.time()
+            count = cleanup(batch_size=options['batch_size'],
+                            sleep=options['sleep'])
+            elapsed = time.time() - start
+            self.stdout.write("Deleted %d %s in %.2fs (%.0f rows/s)" % (
+                count, name, elapsed, count / elapsed if elapsed else 0))
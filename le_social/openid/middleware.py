@@ -1,7 +1,63 @@
-class OpenIDMiddleware(object):
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:  # Django < 1.10
+    MiddlewareMixin = object
+
+from .utils import OpenID, load_openids
+
+
+def get_openids(request):
+    """
+    Returns the OpenIDs associated to the session, oldest first.
+    """
+    if not hasattr(request, '_cached_openids'):
+        openids = load_openids(request.session.get('openids'))
+        request._cached_openids = sorted(
+            (OpenID.deserialize(data) for data in openids.values()),
+            key=lambda openid: openid.issued,
+        )
+    return request._cached_openids
+
+
+def get_openid(request):
+    """
+    Returns the most recently associated OpenID, or None.
+    """
+    openids = get_openids(request)
+    return openids[-1] if openids else None
+
+
+class OpenIDRequestMixin(object):
+    """
+    Gives requests lazy openids and openid properties.
+    """
+    openids = property(get_openids)
+    openid = property(get_openid)
+
+
+_request_classes = {}
+
+
+def set_openids(request):
+    """
+    Sets request.openids and request.openid, lazily: the session is only
+    read when they are accessed. request.openid is None when there is no
+    OpenID.
+    """
+    if hasattr(request, '_cached_openids'):
+        del request._cached_openids
+    cls = request.__class__
+    if not issubclass(cls, OpenIDRequestMixin):
+        if cls not in _request_classes:
+            _request_classes[cls] = type(cls.__name__,
+                                         (OpenIDRequestMixin, cls), {})
+        request.__class__ = _request_classes[cls]
+
+
+class OpenIDMiddleware(MiddlewareMixin):
     """
     Populates request.openid and request.openids
     """
 
     def process_request(self, request):
-        request.openids = request.session.get('openids', [])
+        set_openids(request)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Association',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('server_url', models.CharField(max_length=2047,
+                                                verbose_name='Server URL')),
+                ('handle', models.CharField(max_length=255,
+                                            verbose_name='OpenID handle')),
+                ('secret', models.CharField(max_length=255,
+                                            verbose_name='OpenID secret')),
+                ('issued', models.IntegerField(verbose_name='Issued')),
+                ('lifetime', models.IntegerField(verbose_name='Lifetime')),
+                ('assoc_type', models.CharField(
+                    max_length=64, verbose_name='Association type')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Nonce',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('server_url', models.CharField(max_length=255,
+                                                verbose_name='Server URL')),
+                ('timestamp', models.IntegerField(verbose_name='Timestamp')),
+                ('salt', models.CharField(max_length=40,
+                                          verbose_name='Salt')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_nonces(apps, schema_editor):
+    Nonce = apps.get_model('openid', 'Nonce')
+    duplicates = Nonce.objects.values(
+        'server_url', 'timestamp', 'salt',
+    ).annotate(first=Min('pk'), count=Count('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Nonce.objects.filter(
+            server_url=duplicate['server_url'],
+            timestamp=duplicate['timestamp'],
+            salt=duplicate['salt'],
+        ).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openid', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_nonces,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='nonce',
+            unique_together=set([('server_url', 'timestamp', 'salt')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def delete_associations(apps, schema_editor):
+    """
+    Existing associations have no server URL hash. Hashing them row by row
+    would take hours on large tables, python-openid negotiates new ones
+    instead.
+    """
+    Association = apps.get_model('openid', 'Association')
+    Association.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openid', '0002_nonce_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='association',
+            name='server_url_hash',
+            field=models.CharField(default='', editable=False, max_length=32,
+                                   verbose_name='Server URL hash'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(delete_associations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='nonce',
+            name='timestamp',
+            field=models.IntegerField(db_index=True, verbose_name='Timestamp'),
+        ),
+        migrations.AlterIndexTogether(
+            name='association',
+            index_together=set([('server_url_hash', 'handle')]),
+        ),
+    ]
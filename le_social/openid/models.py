@@ -1,23 +1,54 @@
+from hashlib import md5
+
 from django.db import models
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext_lazy as _
 
 
+def hash_server_url(server_url):
+    return md5(force_bytes(server_url)).hexdigest()
+
+
 class Nonce(models.Model):
     server_url = models.CharField(_('Server URL'), max_length=255)
-    timestamp = models.IntegerField(_('Timestamp'))
+    timestamp = models.IntegerField(_('Timestamp'), db_index=True)
     salt = models.CharField(_('Salt'), max_length=40)
 
+    class Meta:
+        unique_together = ('server_url', 'timestamp', 'salt')
+
     def __unicode__(self):
         return u'Nonce: %s' % self.pk
 
 
+class AssociationQuerySet(models.QuerySet):
+    def for_server_url(self, server_url):
+        """
+        Filters on the indexed hash of server_url. The full URL is still
+        compared to rule out hash collisions.
+        """
+        return self.filter(server_url_hash=hash_server_url(server_url),
+                           server_url=server_url)
+
+
 class Association(models.Model):
     server_url = models.CharField(_('Server URL'), max_length=2047)
+    server_url_hash = models.CharField(_('Server URL hash'), max_length=32,
+                                       editable=False)
     handle = models.CharField(_('OpenID handle'), max_length=255)
     secret = models.CharField(_('OpenID secret'), max_length=255)
     issued = models.IntegerField(_('Issued'))
     lifetime = models.IntegerField(_('Lifetime'))
     assoc_type = models.CharField(_('Association type'), max_length=64)
 
+    objects = AssociationQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('server_url_hash', 'handle')]
+
     def __unicode__(self):
         return u'Association: %s, %s' % (self.server_url, self.handle)
+
+    def save(self, *args, **kwargs):
+        self.server_url_hash = hash_server_url(self.server_url)
+        return super(Association, self).save(*args, **kwargs)
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent after each timed phase of the OpenID flow, by the views and by
+# DjangoOpenIDStore. Arguments: ``phase``, ``duration`` (in seconds) and
+# ``outcome`` ('success', 'cancel', 'failure' or 'setup_needed').
+openid_timing = Signal()
@@ -1,8 +1,7 @@
 import base64
-import operator
 import time
 
-from functools import reduce
+from functools import wraps
 from hashlib import md5
 
 try:
@@ -16,43 +15,61 @@ except ImportError:
     )
 
 from django.conf import settings
-from django.db.models import Q
-
-from .models import Association, Nonce
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.encoding import force_bytes, force_text
+
+from ..utils import CacheMixin, delete_in_batches, timed
+from .models import Association, Nonce, hash_server_url
+from .signals import openid_timing
+
+
+def timed_method(method):
+    """
+    Sends openid_timing around a store method, with the method name as
+    ``phase``. Methods returning False report a failure.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with timed(openid_timing, self.__class__,
+                   phase=method.__name__) as timing:
+            result = method(self, *args, **kwargs)
+            if result is False:
+                timing.outcome = 'failure'
+            return result
+    return wrapper
 
 
 class DjangoOpenIDStore(OpenIDStore):
     def __init__(self):
         self.max_nonce_age = 6 * 60 * 60  # Six hours
 
+    @timed_method
     def storeAssociation(self, server_url, association):
         Association.objects.create(
             server_url=server_url,
             handle=association.handle,
-            secret=base64.encodestring(association.secret),
+            secret=force_text(base64.b64encode(association.secret)),
             issued=association.issued,
             lifetime=association.lifetime,
             assoc_type=association.assoc_type,
         )
 
+    @timed_method
     def getAssociation(self, server_url, handle=None):
-        assocs = []
+        assocs = Association.objects.for_server_url(server_url)
         if handle is not None:
-            assocs = Association.objects.filter(
-                server_url=server_url, handle=handle,
-            )
-        else:
-            assocs = Association.objects.filter(server_url=server_url)
+            assocs = assocs.filter(handle=handle)
         if not assocs:
             return None
         associations = []
         expired = []
         for assoc in assocs:
             association = OIDAssociation(
-                assoc.handle, base64.decodestring(assoc.secret), assoc.issued,
-                assoc.lifetime, assoc.assoc_type,
+                assoc.handle, base64.b64decode(force_bytes(assoc.secret)),
+                assoc.issued, assoc.lifetime, assoc.assoc_type,
             )
-            if association.getExpiresIn() == 0:
+            if association.expiresIn == 0:
                 expired.append(assoc)
             else:
                 associations.append((association.issued, association))
@@ -64,56 +81,174 @@ class DjangoOpenIDStore(OpenIDStore):
         associations.sort()
         return associations[-1][1]
 
+    @timed_method
     def removeAssociation(self, server_url, handle):
-        assocs = list(Association.objects.filter(
-            server_url=server_url, handle=handle,
+        assocs = list(Association.objects.for_server_url(server_url).filter(
+            handle=handle,
         ))
         assocs_exist = len(assocs) > 0
         for assoc in assocs:
             assoc.delete()
         return assocs_exist
 
+    @timed_method
     def useNonce(self, server_url, timestamp, salt):
         if abs(timestamp - time.time()) > nonce.SKEW:
             return False
 
-        query = [
-            Q(server_url__exact=server_url),
-            Q(timestamp__exact=timestamp),
-            Q(salt__exact=salt),
-        ]
         try:
-            Nonce.objects.get(reduce(operator.and_, query))
-        except Nonce.DoesNotExist:
-            Nonce.objects.create(
-                server_url=server_url,
-                timestamp=timestamp,
-                salt=salt,
-            )
-            return True
-        return False
+            with transaction.atomic():
+                Nonce.objects.create(
+                    server_url=server_url,
+                    timestamp=timestamp,
+                    salt=salt,
+                )
+        except IntegrityError:
+            return False
+        return True
 
-    def cleanupNonces(self, _now=None):
+    @timed_method
+    def cleanupNonces(self, _now=None, batch_size=1000, sleep=0):
         if _now is None:
             _now = int(time.time())
         limit = _now - nonce.SKEW
         expired = Nonce.objects.filter(timestamp__lt=limit)
-        count = expired.count()
-        if count:
-            expired.delete()
-        return count
+        return delete_in_batches(expired, batch_size, sleep)
 
-    def cleanupAssociations(self):
+    @timed_method
+    def cleanupAssociations(self, batch_size=1000, sleep=0):
         now = int(time.time())
-        expired = Association.objects.extra(
-            where=['issued + lifetime < %d' % now])
-        count = expired.count()
-        if count:
-            expired.delete()
-        return count
+        expired = Association.objects.filter(issued__lt=now - F('lifetime'))
+        return delete_in_batches(expired, batch_size, sleep)
 
     def getAuthKey(self):
-        return md5(settings.SECRET_KEY).hexdigest()[:self.AUTH_KEY_LEN]
+        key = md5(force_bytes(settings.SECRET_KEY)).hexdigest()
+        return key[:self.AUTH_KEY_LEN]
 
     def isDumb(self):
         return False
+
+
+class CachedDjangoOpenIDStore(CacheMixin, DjangoOpenIDStore):
+    """
+    A DjangoOpenIDStore that reads associations through Django's cache
+    framework. Cache entries expire with the association they hold and are
+    invalidated when associations are stored or removed.
+    """
+    key_prefix = 'le_social.openid.association'
+
+    def get_cache_key(self, server_url, handle=None):
+        key = '%s:%s' % (self.key_prefix, hash_server_url(server_url))
+        if handle is not None:
+            key += ':%s' % md5(force_bytes(handle)).hexdigest()
+        return key
+
+    def storeAssociation(self, server_url, association):
+        super(CachedDjangoOpenIDStore, self).storeAssociation(server_url,
+                                                              association)
+        self.cache.delete_many([
+            self.get_cache_key(server_url),
+            self.get_cache_key(server_url, association.handle),
+        ])
+
+    def getAssociation(self, server_url, handle=None):
+        key = self.get_cache_key(server_url, handle)
+        serialized = self.cache.get(key)
+        if serialized is not None:
+            association = OIDAssociation.deserialize(serialized)
+            if association.expiresIn > 0:
+                return association
+
+        association = super(CachedDjangoOpenIDStore, self).getAssociation(
+            server_url, handle)
+        if association is not None:
+            self.cache.set(key, association.serialize(),
+                           association.expiresIn)
+        return association
+
+    def removeAssociation(self, server_url, handle):
+        removed = super(CachedDjangoOpenIDStore, self).removeAssociation(
+            server_url, handle)
+        self.cache.delete_many([
+            self.get_cache_key(server_url),
+            self.get_cache_key(server_url, handle),
+        ])
+        return removed
+
+
+class CacheOpenIDStore(CacheMixin, OpenIDStore):
+    """
+    An OpenID store that only uses Django's cache framework. Nonces are
+    consumed with an atomic ``add()`` and forgotten once they fall out of the
+    allowed clock skew. Associations are kept per server URL and expire with
+    the most recent one, so there is nothing to clean up.
+
+    Concurrent writes of associations for the same server URL may overwrite
+    each other, python-openid then negotiates a new association.
+    """
+    key_prefix = 'le_social.openid'
+
+    def get_associations_key(self, server_url):
+        return '%s.associations:%s' % (self.key_prefix,
+                                       hash_server_url(server_url))
+
+    def get_nonce_key(self, server_url, timestamp, salt):
+        nonce_id = force_bytes('%s\n%s\n%s' % (server_url, timestamp, salt))
+        return '%s.nonce:%s' % (self.key_prefix, md5(nonce_id).hexdigest())
+
+    def get_associations(self, server_url):
+        """
+        Returns the non-expired associations stored for server_url, as a
+        dict of OIDAssociation objects keyed by handle.
+        """
+        serialized = self.cache.get(self.get_associations_key(server_url), {})
+        associations = {}
+        for handle, value in serialized.items():
+            association = OIDAssociation.deserialize(value)
+            if association.expiresIn > 0:
+                associations[handle] = association
+        return associations
+
+    def set_associations(self, server_url, associations):
+        key = self.get_associations_key(server_url)
+        if not associations:
+            self.cache.delete(key)
+            return
+        timeout = max(a.expiresIn for a in associations.values())
+        self.cache.set(key, dict(
+            (handle, a.serialize()) for handle, a in associations.items()
+        ), timeout)
+
+    def storeAssociation(self, server_url, association):
+        associations = self.get_associations(server_url)
+        associations[association.handle] = association
+        self.set_associations(server_url, associations)
+
+    def getAssociation(self, server_url, handle=None):
+        associations = self.get_associations(server_url)
+        if handle is not None:
+            return associations.get(handle)
+        if not associations:
+            return None
+        return max(associations.values(), key=lambda a: a.issued)
+
+    def removeAssociation(self, server_url, handle):
+        associations = self.get_associations(server_url)
+        if associations.pop(handle, None) is None:
+            return False
+        self.set_associations(server_url, associations)
+        return True
+
+    def useNonce(self, server_url, timestamp, salt):
+        now = time.time()
+        if abs(timestamp - now) > nonce.SKEW:
+            return False
+        key = self.get_nonce_key(server_url, timestamp, salt)
+        timeout = max(int(timestamp + nonce.SKEW - now), 1)
+        return self.cache.add(key, 1, timeout)
+
+    def cleanupNonces(self):
+        return 0
+
+    def cleanupAssociations(self):
+        return 0
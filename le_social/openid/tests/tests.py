@@ -3,10 +3,32 @@ try:
 except ImportError:
     from django.utils.unittest import skipIf
 
+import json
+import pickle
+import time
+
+import django
+
 try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    from openid.association import Association as OIDAssociation
     from openid.consumer import consumer
+    from openid.consumer.discover import DiscoveryFailure
     from openid.message import Message
-    from .. import utils
+    from ..middleware import OpenIDMiddleware
+    from ..signals import openid_timing
+    from ..models import Association, Nonce
+    from ..store import (CachedDjangoOpenIDStore, CacheOpenIDStore,
+                         DjangoOpenIDStore)
+    from ..utils import (cached_discover as real_cached_discover,
+                         get_provider_breaker, install_fetcher,
+                         load_openids, OpenID, provider_options,
+                         ProviderFetcher, remember_openid)
+    from openid import fetchers
     openid = True
 except ImportError:
     openid = False
@@ -15,22 +37,37 @@ try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+
+def cached_discover(openid_url, timeout, failure_timeout, sender,
+                    cache_alias):
+    return openid_url, []
 
 
-def discover_extensions(openid_url):
+def discover_extensions(openid_url, services=None):
     """
     Don't bother with extensions for tests.
     """
     return False, False
 
 
+class OpenidEndpoint(object):
+    server_url = 'https://openid.example.com/server'
+
+
 class OpenidRequest(object):
     """
     Fake OpenID request
     """
     def __init__(self, url):
         self.url = url
+        self.endpoint = OpenidEndpoint()
 
     def addExtension(self, sreg_request):
         pass
@@ -63,11 +100,15 @@ class Consumer(object):
     """
     Fake OpenID consumer
     """
+    last_session = None
+
     def __init__(self, session, store_class):
         self.session = session
         self.store_class = store_class
+        Consumer.last_session = dict(session)
 
     def begin(self, url):
+        self.session['endpoint'] = url
         return OpenidRequest(url)
 
     def complete(self, query, return_url):
@@ -76,19 +117,19 @@ class Consumer(object):
         return OpenidResponse(consumer.SUCCESS, Message())
 
 
+@override_settings(ROOT_URLCONF='le_social.openid.tests.urls')
 class OpenidTest(TestCase):
-    urls = 'le_social.openid.tests.urls'
-
     def setUp(self):
-        self._real_consumer = consumer.Consumer
-        consumer.Consumer = Consumer
-
-        self._real_discover_extensions = utils.discover_extensions
-        utils.discover_extensions = discover_extensions
-
-    def tearDown(self):
-        consumer.Consumer = self._real_consumer
-        utils.discover_extensions = self._real_discover_extensions
+        cache.clear()
+        patchers = [
+            patch('le_social.openid.views.Consumer', Consumer),
+            patch('le_social.openid.views.cached_discover', cached_discover),
+            patch('le_social.openid.views.discover_extensions',
+                  discover_extensions),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
     def test_openid_assoc(self):
         url = reverse('openid_begin')
@@ -98,6 +139,22 @@ class OpenidTest(TestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, 302)
 
+    def test_provider_unavailable(self):
+        breaker = get_provider_breaker('http://bruno.renie.fr/',
+                                       failure_threshold=1)
+        breaker.record_failure()
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        response = self.client.post(reverse('openid_begin'), data)
+        self.assertContains(response, 'The OpenID provider is unavailable')
+
+    def test_delegated_provider_unavailable(self):
+        breaker = get_provider_breaker(OpenidEndpoint.server_url,
+                                       failure_threshold=1)
+        breaker.record_failure()
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        response = self.client.post(reverse('openid_begin'), data)
+        self.assertContains(response, 'The OpenID provider is unavailable')
+
     def test_failed_callback(self):
         url = reverse('openid_callback')
         response = self.client.get(url)
@@ -107,4 +164,447 @@ class OpenidTest(TestCase):
         url = reverse('openid_callback') + '?type=success'
         response = self.client.get(url)
         self.assertContains(response, 'OpenID association')
+        openids = self.client.session['openids']
+        self.assertEqual(list(openids), ['http://bruno.renie.fr'])
+
+        self.client.get(url)
+        self.assertEqual(len(self.client.session['openids']), 1)
+
+    @patch('le_social.openid.views.ConsumerStateMixin.stateless', True)
+    def test_stateless(self):
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        response = self.client.post(reverse('openid_begin'), data)
+        self.assertEqual(Session.objects.count(), 0)
+        url = response['Location'] + '&type=success'
+        self.assertIn('?openid_state=', url)
+
+        response = self.client.get(url)
+        self.assertContains(response, 'OpenID association')
+        self.assertEqual(Consumer.last_session,
+                         {'endpoint': 'http://bruno.renie.fr'})
+
+        # The state is only used once
+        self.client.get(url)
+        self.assertEqual(Consumer.last_session, {})
+
+        # Begin always starts from a fresh state
+        response = self.client.post(reverse('openid_begin'), data)
+        state_url = response['Location']
+        state_id = state_url.split('openid_state=')[1]
+        self.client.post(reverse('openid_begin') + '?openid_state=' +
+                         state_id, {'openid_url': 'http://example.com'})
+        self.assertEqual(Consumer.last_session, {})
+        self.client.get(state_url)
+        self.assertEqual(Consumer.last_session,
+                         {'endpoint': 'http://bruno.renie.fr'})
+
+    def test_rate_limit(self):
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        url = reverse('openid_begin')
+        with patch('le_social.openid.views.Begin.rate_limit', (1, 60)):
+            self.assertEqual(self.client.post(url, data).status_code, 302)
+            self.assertEqual(self.client.post(url, data).status_code, 429)
+            response = self.client.post(url, {'openid_url': ''})
+            self.assertEqual(response.status_code, 200)
+
+    def test_timing_signal(self):
+        timings = []
+
+        def receiver(sender, phase, duration, outcome, **kwargs):
+            timings.append((phase, outcome))
+        openid_timing.connect(receiver)
+        self.addCleanup(openid_timing.disconnect, receiver)
+
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        self.client.post(reverse('openid_begin'), data)
+        self.assertEqual(timings, [('begin', 'success')])
+
+        del timings[:]
+        self.client.get(reverse('openid_callback'))
+        self.client.get(reverse('openid_callback') + '?type=success')
+        self.assertEqual(timings, [('complete', 'failure'),
+                                   ('complete', 'success')])
 OpenidTest = skipIf(not openid, "openid not installed")(OpenidTest)
+
+
+@skipIf(django.VERSION < (3, 1), "async views require Django 3.1")
+class AsyncOpenidTest(OpenidTest):
+    def test_openid_assoc(self):
+        url = reverse('async_openid_begin')
+        response = self.client.get(url)
+        self.assertContains(response, '<form ')
+        data = {'openid_url': 'http://bruno.renie.fr'}
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_failed_callback(self):
+        response = self.client.get(reverse('async_openid_callback'))
+        self.assertContains(response, 'Invalid openid.mode')
+
+    def test_successful_callback(self):
+        url = reverse('async_openid_callback') + '?type=success'
+        response = self.client.get(url)
+        self.assertContains(response, 'OpenID association')
+
+
+class OpenIDObjectTest(TestCase):
+    def test_serialization(self):
+        openid = OpenID('http://example.com', 12, ['openid.mode'],
+                        {'email': 'foo@example.com'})
+        data = json.loads(json.dumps(openid.serialize()))
+        self.assertEqual(data, ['http://example.com', 12, ['openid.mode'],
+                                {'email': 'foo@example.com'}])
+
+        for copy in (OpenID.deserialize(data),
+                     pickle.loads(pickle.dumps(openid))):
+            self.assertEqual(copy.openid, 'http://example.com')
+            self.assertEqual(copy.issued, 12)
+            self.assertEqual(copy.attrs, ['openid.mode'])
+            self.assertEqual(copy.sreg, {'email': 'foo@example.com'})
+            self.assertEqual(copy.ax, {})
+        self.assertIs(OpenID.deserialize(openid), openid)
+
+    def test_legacy_pickle(self):
+        # OpenID('http://example.com', 12, ['openid.mode'],
+        #        {'email': 'foo@example.com'}) pickled by version 0.9
+        legacy = [
+            b'ccopy_reg\n_reconstructor\np0\n(cle_social.openid.utils\n'
+            b'OpenID\np1\nc__builtin__\nobject\np2\nNtp3\nRp4\n(dp5\n'
+            b'Vopenid\np6\nVhttp://example.com\np7\nsVissued\np8\nI12\n'
+            b'sVattrs\np9\n(lp10\nVopenid.mode\np11\nasVsreg\np12\n'
+            b'(dp13\nVemail\np14\nVfoo@example.com\np15\nssVax\np16\n'
+            b'(dp17\nsVis_iname\np18\nI00\nsb.',
+            b'\x80\x02cle_social.openid.utils\nOpenID\nq\x00)\x81q\x01}q'
+            b'\x02(X\x06\x00\x00\x00openidq\x03X\x12\x00\x00\x00'
+            b'http://example.comq\x04X\x06\x00\x00\x00issuedq\x05K\x0cX'
+            b'\x05\x00\x00\x00attrsq\x06]q\x07X\x0b\x00\x00\x00'
+            b'openid.modeq\x08aX\x04\x00\x00\x00sregq\t}q\nX\x05\x00'
+            b'\x00\x00emailq\x0bX\x0f\x00\x00\x00foo@example.comq\x0cs'
+            b'X\x02\x00\x00\x00axq\r}q\x0eX\x08\x00\x00\x00is_inameq'
+            b'\x0f\x89ub.',
+        ]
+        for data in legacy:
+            openid = pickle.loads(data)
+            self.assertIsInstance(openid, OpenID)
+            self.assertFalse(openid.is_iname)
+            self.assertEqual(openid.serialize(), [
+                'http://example.com', 12, ['openid.mode'],
+                {'email': 'foo@example.com'}])
+            self.assertEqual(load_openids([openid]), {
+                'http://example.com': openid.serialize()})
+
+    def test_is_iname(self):
+        self.assertFalse(OpenID('http://example.com', 0).is_iname)
+        self.assertTrue(OpenID('=example', 0).is_iname)
+        self.assertEqual(OpenID('=example', 0).serialize(), ['=example', 0])
+
+    def test_remember_openid(self):
+        openids = load_openids([['http://a.example.com', 1]])
+        self.assertEqual(openids, {'http://a.example.com':
+                                   ['http://a.example.com', 1]})
+        remember_openid(openids, OpenID('http://b.example.com', 2), 2)
+        remember_openid(openids, OpenID('http://a.example.com', 3), 2)
+        remember_openid(openids, OpenID('http://c.example.com', 4), 2)
+        self.assertEqual(sorted(openids), ['http://a.example.com',
+                                           'http://c.example.com'])
+        self.assertEqual(openids['http://a.example.com'][1], 3)
+        self.assertIs(load_openids(openids), openids)
+OpenIDObjectTest = skipIf(not openid, "openid not installed")(
+    OpenIDObjectTest)
+
+
+class SessionStub(dict):
+    accessed = False
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(SessionStub, self).get(key, default)
+
+
+class MiddlewareTest(TestCase):
+    def get_request(self, openids):
+        request = RequestFactory().get('/')
+        request.session = SessionStub(openids=openids)
+        OpenIDMiddleware().process_request(request)
+        return request
+
+    def test_lazy_openids(self):
+        request = self.get_request({
+            'http://b.example.com': ['http://b.example.com', 2],
+            'http://a.example.com': ['http://a.example.com', 1],
+        })
+        self.assertFalse(request.session.accessed)
+
+        self.assertEqual(len(request.openids), 2)
+        self.assertTrue(request.session.accessed)
+        self.assertEqual([o.openid for o in request.openids],
+                         ['http://a.example.com', 'http://b.example.com'])
+        self.assertEqual(request.openid.openid, 'http://b.example.com')
+        self.assertIs(request.openid, request.openids[1])
+
+    def test_no_openid(self):
+        request = self.get_request({})
+        self.assertEqual(request.openids, [])
+        self.assertIsNone(request.openid)
+MiddlewareTest = skipIf(not openid, "openid not installed")(MiddlewareTest)
+
+
+@patch('le_social.openid.utils.discover')
+class DiscoveryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_discovery(self, discover):
+        discover.return_value = ('https://example.com/', ['service'])
+        for url in ('https://example.com/', 'https://EXAMPLE.com'):
+            self.assertEqual(real_cached_discover(url),
+                             ('https://example.com/', ['service']))
+        self.assertEqual(discover.call_count, 1)
+
+    def test_timing_signal(self, discover):
+        timings = []
+
+        def receiver(sender, phase, duration, outcome, **kwargs):
+            timings.append((sender, phase, outcome))
+        openid_timing.connect(receiver)
+        self.addCleanup(openid_timing.disconnect, receiver)
+
+        discover.return_value = ('https://example.com/', ['service'])
+        for i in range(2):
+            real_cached_discover('https://example.com/', sender=OpenID)
+        discover.side_effect = DiscoveryFailure('Nope', None)
+        for i in range(2):
+            with self.assertRaises(DiscoveryFailure):
+                real_cached_discover('https://example.org/')
+        # Cache hits aren't timed
+        self.assertEqual(timings, [(OpenID, 'discovery', 'success'),
+                                   (None, 'discovery', 'failure')])
+
+    def test_failed_discovery(self, discover):
+        discover.side_effect = DiscoveryFailure('Nope', None)
+        for i in range(2):
+            with self.assertRaises(DiscoveryFailure):
+                real_cached_discover('https://example.com/')
+        self.assertEqual(discover.call_count, 1)
+DiscoveryTest = skipIf(not openid, "openid not installed")(DiscoveryTest)
+
+
+class FetcherTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_circuit_breaker(self):
+        fetcher = ProviderFetcher(failure_threshold=2)
+        with patch.object(fetcher.fetcher, 'fetch') as fetch:
+            fetch.side_effect = IOError('timed out')
+            for i in range(3):
+                with self.assertRaises(fetchers.HTTPFetchingError):
+                    fetcher.fetch('https://example.com/openid')
+            self.assertEqual(fetch.call_count, 2)
+
+            fetch.side_effect = None
+            fetch.return_value = fetchers.HTTPResponse(status=200)
+            fetcher.fetch('https://other.example.com/openid')
+            self.assertEqual(fetch.call_count, 3)
+
+    def test_provider_options(self):
+        fetcher = ProviderFetcher()
+        with patch.object(fetchers.Urllib2Fetcher, 'urlopen') as urlopen:
+            fetcher.urlopen('request')
+            urlopen.assert_called_with('request', timeout=10)
+            with provider_options(timeout=3):
+                fetcher.urlopen('request')
+            urlopen.assert_called_with('request', timeout=3)
+
+        with patch.object(fetcher.fetcher, 'fetch') as fetch:
+            fetch.side_effect = IOError('timed out')
+            with provider_options(failure_threshold=1):
+                for i in range(2):
+                    with self.assertRaises(fetchers.HTTPFetchingError):
+                        fetcher.fetch('https://user@example.com:8000/')
+            self.assertEqual(fetch.call_count, 1)
+        self.assertTrue(get_provider_breaker('https://example.com').is_open())
+
+    def test_install_fetcher(self):
+        project_fetcher = fetchers.Urllib2Fetcher()
+        with patch.object(fetchers, '_default_fetcher', project_fetcher):
+            install_fetcher()
+            installed = fetchers.getDefaultFetcher()
+            self.assertIsInstance(installed, ProviderFetcher)
+            self.assertIs(installed.fetcher, project_fetcher)
+            install_fetcher()
+            self.assertIs(fetchers.getDefaultFetcher(), installed)
+FetcherTest = skipIf(not openid, "openid not installed")(FetcherTest)
+
+
+class StoreTest(TestCase):
+    server_url = 'http://openid.example.com/server'
+
+    def setUp(self):
+        cache.clear()
+
+    def association(self, handle='handle', issued=None, lifetime=600):
+        if issued is None:
+            issued = int(time.time())
+        return OIDAssociation(handle, b'secret', issued, lifetime,
+                              'HMAC-SHA1')
+
+    def test_timing_signal(self):
+        timings = []
+
+        def receiver(sender, phase, duration, outcome, **kwargs):
+            timings.append((sender, phase, outcome))
+            self.assertTrue(duration >= 0)
+        openid_timing.connect(receiver)
+        self.addCleanup(openid_timing.disconnect, receiver)
+
+        store = DjangoOpenIDStore()
+        now = int(time.time())
+        store.useNonce(self.server_url, now, 'salt')
+        store.useNonce(self.server_url, now, 'salt')
+        self.assertEqual(timings, [
+            (DjangoOpenIDStore, 'useNonce', 'success'),
+            (DjangoOpenIDStore, 'useNonce', 'failure'),
+        ])
+
+    def test_cached_association(self):
+        store = CachedDjangoOpenIDStore()
+        store.storeAssociation(self.server_url, self.association())
+
+        with self.assertNumQueries(1):
+            assoc = store.getAssociation(self.server_url, 'handle')
+            self.assertEqual(assoc.secret, b'secret')
+            assoc = store.getAssociation(self.server_url, 'handle')
+            self.assertEqual(assoc.handle, 'handle')
+
+        with self.assertNumQueries(1):
+            store.getAssociation(self.server_url)
+            store.getAssociation(self.server_url)
+
+    def test_cache_invalidation(self):
+        store = CachedDjangoOpenIDStore()
+        store.storeAssociation(self.server_url,
+                               self.association('old', time.time() - 10))
+        self.assertEqual(store.getAssociation(self.server_url).handle, 'old')
+
+        store.storeAssociation(self.server_url, self.association('new'))
+        self.assertEqual(store.getAssociation(self.server_url).handle, 'new')
+
+        self.assertTrue(store.removeAssociation(self.server_url, 'new'))
+        self.assertEqual(Association.objects.count(), 1)
+        self.assertIsNone(store.getAssociation(self.server_url, 'new'))
+        self.assertEqual(store.getAssociation(self.server_url).handle, 'old')
+
+    def test_concurrent_removal(self):
+        store = CachedDjangoOpenIDStore()
+        store.storeAssociation(self.server_url, self.association())
+        remove = DjangoOpenIDStore.removeAssociation
+
+        def concurrent_remove(self, server_url, handle):
+            # Another process reads the association in the meantime
+            CachedDjangoOpenIDStore().getAssociation(server_url, handle)
+            return remove(self, server_url, handle)
+
+        with patch.object(DjangoOpenIDStore, 'removeAssociation',
+                          concurrent_remove):
+            self.assertTrue(store.removeAssociation(self.server_url,
+                                                    'handle'))
+        self.assertIsNone(store.getAssociation(self.server_url, 'handle'))
+
+    def test_expired_association(self):
+        store = CachedDjangoOpenIDStore()
+        store.storeAssociation(self.server_url,
+                               self.association(issued=0, lifetime=60))
+        self.assertIsNone(store.getAssociation(self.server_url, 'handle'))
+        self.assertEqual(Association.objects.count(), 0)
+
+    def test_use_nonce(self):
+        store = DjangoOpenIDStore()
+        now = int(time.time())
+        self.assertTrue(store.useNonce(self.server_url, now, 'salt'))
+        self.assertFalse(store.useNonce(self.server_url, now, 'salt'))
+        self.assertTrue(store.useNonce(self.server_url, now, 'pepper'))
+        self.assertFalse(store.useNonce(self.server_url, 0, 'salt'))
+        self.assertEqual(Nonce.objects.count(), 2)
+
+    def test_cleanup(self):
+        store = DjangoOpenIDStore()
+        now = int(time.time())
+        for salt in range(5):
+            Nonce.objects.create(server_url=self.server_url, timestamp=0,
+                                 salt=salt)
+        Nonce.objects.create(server_url=self.server_url, timestamp=now,
+                             salt='fresh')
+        for handle, issued in (('a', 0), ('b', 0), ('c', now)):
+            store.storeAssociation(self.server_url,
+                                   self.association(handle, issued))
+
+        self.assertEqual(store.cleanupNonces(batch_size=2), 5)
+        self.assertEqual(store.cleanupAssociations(batch_size=2), 2)
+        self.assertEqual(Nonce.objects.get().salt, 'fresh')
+        self.assertEqual(Association.objects.get().handle, 'c')
+
+    def test_cleanup_command(self):
+        Nonce.objects.create(server_url=self.server_url, timestamp=0,
+                             salt='salt')
+        stdout = StringIO()
+        call_command('openid_cleanup', batch_size=10, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn('Deleted 1 nonces', output)
+        self.assertIn('Deleted 0 associations', output)
+        self.assertEqual(Nonce.objects.count(), 0)
+StoreTest = skipIf(not openid, "openid not installed")(StoreTest)
+
+
+class CacheStoreTest(TestCase):
+    server_url = 'http://openid.example.com/server'
+
+    def setUp(self):
+        cache.clear()
+
+    def association(self, handle='handle', issued=None, lifetime=600):
+        if issued is None:
+            issued = int(time.time())
+        return OIDAssociation(handle, b'secret', issued, lifetime,
+                              'HMAC-SHA1')
+
+    def test_associations(self):
+        store = CacheOpenIDStore()
+        self.assertIsNone(store.getAssociation(self.server_url))
+        with self.assertNumQueries(0):
+            store.storeAssociation(self.server_url,
+                                   self.association('old', time.time() - 10))
+            store.storeAssociation(self.server_url, self.association('new'))
+            store.storeAssociation(self.server_url,
+                                   self.association('expired', 0, 60))
+
+        self.assertEqual(store.getAssociation(self.server_url).handle, 'new')
+        self.assertEqual(store.getAssociation(self.server_url, 'old').secret,
+                         b'secret')
+        self.assertIsNone(store.getAssociation(self.server_url, 'expired'))
+        self.assertIsNone(store.getAssociation('http://example.com'))
+
+        self.assertTrue(store.removeAssociation(self.server_url, 'new'))
+        self.assertFalse(store.removeAssociation(self.server_url, 'new'))
+        self.assertEqual(store.getAssociation(self.server_url).handle, 'old')
+
+    def test_use_nonce(self):
+        store = CacheOpenIDStore()
+        now = int(time.time())
+        with self.assertNumQueries(0):
+            self.assertTrue(store.useNonce(self.server_url, now, 'salt'))
+            self.assertFalse(store.useNonce(self.server_url, now, 'salt'))
+            self.assertTrue(store.useNonce(self.server_url, now, 'pepper'))
+            self.assertFalse(store.useNonce(self.server_url, 0, 'salt'))
+
+    def test_store_setting(self):
+        from ..views import Begin, Callback
+
+        self.assertIs(Begin().get_store_class(), DjangoOpenIDStore)
+        store = 'le_social.openid.store.CacheOpenIDStore'
+        with self.settings(OPENID_STORE=store):
+            self.assertIs(Begin().get_store_class(), CacheOpenIDStore)
+            self.assertIsInstance(Callback().get_store(), CacheOpenIDStore)
+            view = Callback(store_class=CachedDjangoOpenIDStore)
+            self.assertIs(view.get_store_class(), CachedDjangoOpenIDStore)
+CacheStoreTest = skipIf(not openid, "openid not installed")(CacheStoreTest)
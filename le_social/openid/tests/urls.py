@@ -1,10 +1,18 @@
-from django.conf.urls import patterns, url
+import django
+
+from django.conf.urls import url
 
 from . import views
 
 
-urlpatterns = patterns(
-    '',
+urlpatterns = [
     url(r'^openid/$', views.begin, name='openid_begin'),
     url(r'^openid/complete/$', views.callback, name='openid_callback'),
-)
+]
+
+if django.VERSION >= (3, 1):
+    urlpatterns += [
+        url(r'^async/openid/$', views.async_begin, name='async_openid_begin'),
+        url(r'^async/openid/complete/$', views.async_callback,
+            name='async_openid_callback'),
+    ]
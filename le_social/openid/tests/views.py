@@ -1,3 +1,5 @@
+import django
+
 try:
     from django.urls import reverse
 except ImportError:
@@ -28,3 +30,15 @@ class Callback(Common, views.Callback):
         openid_url = self.openid_response.identity_url
         return HttpResponse('OpenID association: %s' % openid_url)
 callback = Callback.as_view()
+
+
+if django.VERSION >= (3, 1):
+    from .. import async_views
+
+    class AsyncBegin(Common, async_views.Begin):
+        template_name = 'le_social/openid/openid.html'
+    async_begin = AsyncBegin.as_view()
+
+    class AsyncCallback(Callback, async_views.Callback):
+        pass
+    async_callback = AsyncCallback.as_view()
@@ -1,7 +1,18 @@
+import threading
 import time
 
+from contextlib import contextmanager
+from hashlib import md5
+
 try:
-    from openid.consumer.discover import discover
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    from openid import fetchers
+    from openid.consumer.discover import (discover, normalizeURL,
+                                          DiscoveryFailure)
     from openid.extensions import sreg, ax
     from openid.yadis import xri
 except ImportError:
@@ -10,18 +21,64 @@ except ImportError:
         "python-openid is required to use le_social.openid"
     )
 
-from django.http import get_host
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
 from django.utils.html import escape
 
+from ..circuitbreaker import CircuitBreaker, CircuitOpen
+from ..utils import timed
+from .signals import openid_timing
+
 
 class OpenID(object):
+    __slots__ = ('openid', 'issued', 'attrs', 'sreg', 'ax', '_is_iname')
+
     def __init__(self, openid, issued, attrs=None, sreg_=None, ax_=None):
         self.openid = openid
         self.issued = issued
         self.attrs = attrs or {}
         self.sreg = sreg_ or {}
         self.ax = ax_ or {}
-        self.is_iname = (xri.identifierScheme(openid) == 'XRI')
+        self._is_iname = None
+
+    @property
+    def is_iname(self):
+        if self._is_iname is None:
+            self._is_iname = xri.identifierScheme(self.openid) == 'XRI'
+        return self._is_iname
+
+    def serialize(self):
+        """
+        Returns a compact, JSON-serializable list. Empty trailing values are
+        left out.
+        """
+        data = [self.openid, self.issued, self.attrs, self.sreg, self.ax]
+        while len(data) > 2 and not data[-1]:
+            data.pop()
+        return data
+
+    @classmethod
+    def deserialize(cls, data):
+        if isinstance(data, cls):  # Pickled by older versions
+            return data
+        return cls(*data)
+
+    def __reduce__(self):
+        return self.__class__, tuple(self.serialize())
+
+    def __setstate__(self, state):
+        """
+        Loads OpenIDs pickled by older versions, which saved their
+        ``__dict__``.
+        """
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+            state = dict(dict_state or {}, **(slots_state or {}))
+        state = dict(state)
+        is_iname = state.pop('is_iname', state.pop('_is_iname', None))
+        self.__init__(state.pop('openid'), state.pop('issued'),
+                      state.get('attrs'), state.get('sreg'), state.get('ax'))
+        self._is_iname = is_iname
 
     def __repr__(self):
         return '<OpenID: %s>' % self.openid
@@ -30,17 +87,172 @@ class OpenID(object):
         return self.openid
 
 
+def load_openids(data):
+    """
+    Returns the OpenIDs stored in the session as a dict of serialized
+    OpenIDs, keyed by OpenID URL. Older sessions stored a list.
+    """
+    if isinstance(data, dict):
+        return data
+    openids = {}
+    for item in data or []:
+        item = OpenID.deserialize(item).serialize()
+        openids[item[0]] = item
+    return openids
+
+
+def remember_openid(openids, openid, max_openids=None):
+    """
+    Adds ``openid`` to a dict returned by ``load_openids()``, evicting the
+    least recently used OpenIDs to keep at most ``max_openids`` entries.
+    """
+    openids.pop(openid.openid, None)
+    openids[openid.openid] = openid.serialize()
+    if max_openids:
+        while len(openids) > max_openids:
+            oldest = min(openids, key=lambda url: openids[url][1])
+            del openids[oldest]
+    return openids
+
+
 def get_url_host(request):
     scheme = 'https' if request.is_secure() else 'http'
-    host = escape(get_host(request))
+    host = escape(request.get_host())
     return '%s://%s' % (scheme, host)
 
 
-def discover_extensions(openid_url):
-    service = discover(openid_url)
+def normalize_identifier(openid_url):
+    if xri.identifierScheme(openid_url) == 'XRI':
+        return openid_url.strip()
+    return normalizeURL(openid_url)
+
+
+def cached_discover(openid_url, timeout=60 * 5, failure_timeout=60,
+                    sender=None, cache_alias='default'):
+    """
+    Same as python-openid's ``discover()`` but the results are cached for
+    ``timeout`` seconds in the ``cache_alias`` cache, keyed by the normalized
+    identifier. Failures are cached for ``failure_timeout`` seconds and raise
+    ``DiscoveryFailure`` again until they expire.
+
+    Actual discoveries send ``openid_timing`` on behalf of ``sender``.
+    """
+    identifier = normalize_identifier(openid_url)
+    key = 'le_social.openid.discovery:%s' % md5(
+        force_bytes(identifier)).hexdigest()
+    cache = caches[cache_alias]
+    cached = cache.get(key)
+    if cached is not None:
+        if cached[0] == 'failure':
+            raise DiscoveryFailure(cached[1], None)
+        return cached[1:]
+
+    try:
+        with timed(openid_timing, sender, phase='discovery'):
+            claimed_id, services = discover(openid_url)
+    except DiscoveryFailure as e:
+        cache.set(key, ('failure', str(e)), failure_timeout)
+        raise
+    cache.set(key, ('success', claimed_id, services),
+              timeout if services else failure_timeout)
+    return claimed_id, services
+
+
+def get_provider_breaker(url, failure_threshold=5, recovery_timeout=30):
+    """
+    Returns the circuit breaker of the host serving url.
+    """
+    host = urlparse(url).hostname or ''
+    return CircuitBreaker('openid:%s' % host, failure_threshold,
+                          recovery_timeout)
+
+
+_provider_options = threading.local()
+
+
+@contextmanager
+def provider_options(timeout=10, failure_threshold=5, recovery_timeout=30):
+    """
+    Sets the options ProviderFetcher uses for the fetches made by the
+    current thread within the block.
+    """
+    previous = getattr(_provider_options, 'options', None)
+    _provider_options.options = (timeout, failure_threshold, recovery_timeout)
+    try:
+        yield
+    finally:
+        _provider_options.options = previous
+
+
+class ProviderFetcher(fetchers.ExceptionWrappingFetcher):
+    """
+    python-openid fetcher adding a circuit breaker per host to another
+    fetcher, by default urllib with a timeout. Network errors and 5xx
+    responses count as failures, fetches to a host with an open circuit fail
+    immediately.
+
+    The options are the ones set by ``provider_options()`` in the current
+    thread, or the ones passed to the constructor.
+    """
+    def __init__(self, fetcher=None, timeout=10, failure_threshold=5,
+                 recovery_timeout=30):
+        if fetcher is None:
+            fetcher = fetchers.Urllib2Fetcher()
+            fetcher.urlopen = self.urlopen
+        elif isinstance(fetcher, fetchers.ExceptionWrappingFetcher):
+            fetcher = fetcher.fetcher
+        fetchers.ExceptionWrappingFetcher.__init__(self, fetcher)
+        self.options = (timeout, failure_threshold, recovery_timeout)
+
+    def get_options(self):
+        return getattr(_provider_options, 'options', None) or self.options
+
+    def urlopen(self, request):
+        return fetchers.Urllib2Fetcher.urlopen(request,
+                                               timeout=self.get_options()[0])
+
+    def fetch(self, url, body=None, headers=None):
+        breaker = get_provider_breaker(url, *self.get_options()[1:])
+        if breaker.is_open():
+            raise fetchers.HTTPFetchingError(why=CircuitOpen(breaker.name))
+        try:
+            response = fetchers.ExceptionWrappingFetcher.fetch(
+                self, url, body, headers)
+        except fetchers.HTTPFetchingError:
+            breaker.record_failure()
+            raise
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+_install_lock = threading.Lock()
+
+
+def install_fetcher():
+    """
+    Makes a ProviderFetcher python-openid's default fetcher. A fetcher set up
+    by the project is wrapped instead of being replaced. Does nothing if a
+    ProviderFetcher is already installed.
+    """
+    # python-openid has no public way to tell whether a fetcher was set
+    if isinstance(fetchers._default_fetcher, ProviderFetcher):
+        return
+    with _install_lock:
+        current = fetchers._default_fetcher
+        if not isinstance(current, ProviderFetcher):
+            fetchers.setDefaultFetcher(ProviderFetcher(current),
+                                       wrap_exceptions=False)
+
+
+def discover_extensions(openid_url, services=None):
+    if services is None:
+        services = discover(openid_url)[1]
     use_ax = False
     use_sreg = False
-    for endpoint in service[1]:
+    for endpoint in services:
         if not use_sreg:
             use_sreg = sreg.supportsSReg(endpoint)
         if not use_ax:
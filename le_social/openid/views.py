@@ -1,4 +1,5 @@
 try:
+    from openid import fetchers
     from openid.consumer.consumer import (Consumer, SUCCESS, CANCEL, FAILURE,
                                           SETUP_NEEDED)
     from openid.consumer.discover import DiscoveryFailure
@@ -9,15 +10,30 @@ except ImportError:
         "python-openid is required to use le_social.openid"
     )
 
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from django.conf import settings
+from django.core.cache import caches
 from django.shortcuts import redirect
-from django.utils.encoding import smart_unicode
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_text
+from django.utils.module_loading import import_string
 from django.utils.translation import ugettext_lazy as _
 from django.views import generic
 
+from ..ratelimit import RateLimitMixin
+from ..utils import timed
 from .forms import OpenIDForm
-from .middleware import OpenIDMiddleware
+from .middleware import set_openids
+from .signals import openid_timing
 from .store import DjangoOpenIDStore
-from .utils import get_url_host, discover_extensions, from_openid_response
+from .utils import (get_url_host, cached_discover, discover_extensions,
+                    from_openid_response, get_provider_breaker,
+                    install_fetcher, provider_options,
+                    load_openids, remember_openid)
 
 
 class ReturnUrlMixin(object):
@@ -30,14 +46,118 @@ class ReturnUrlMixin(object):
         return get_url_host(self.request) + self.return_url
 
 
-class Begin(generic.FormView, ReturnUrlMixin):
+class StoreMixin(object):
+    store_class = None
+
+    def get_store_class(self):
+        if self.store_class is not None:
+            return self.store_class
+        if hasattr(settings, 'OPENID_STORE'):
+            return import_string(settings.OPENID_STORE)
+        return DjangoOpenIDStore
+
+    def get_store(self):
+        return self.get_store_class()()
+
+
+class ConsumerStateMixin(object):
+    """
+    Where python-openid keeps its state between Begin and Callback. In the
+    session by default, or with ``stateless = True`` in the cache for
+    ``state_timeout`` seconds, under a random id passed along in the return
+    URL.
+    """
+    stateless = False
+    state_timeout = 60 * 10
+    state_param = 'openid_state'
+    state_cache_alias = 'default'
+
+    @property
+    def state_cache(self):
+        return caches[self.state_cache_alias]
+
+    def get_state_cache_key(self, state_id):
+        return 'le_social.openid.state:%s' % state_id
+
+    def new_consumer_session(self):
+        """
+        Returns the session given to python-openid's consumer in Begin. In
+        stateless mode, the flow always starts from a fresh state.
+        """
+        if not self.stateless:
+            return self.request.session
+        return {}
+
+    def load_consumer_session(self):
+        """
+        Returns the session given to python-openid's consumer in Callback.
+        In stateless mode, the state referenced by the request is loaded and
+        removed from the cache.
+        """
+        if not self.stateless:
+            return self.request.session
+        state_id = self.request.GET.get(self.state_param)
+        if not state_id:
+            return {}
+        key = self.get_state_cache_key(state_id)
+        state = self.state_cache.get(key)
+        self.state_cache.delete(key)
+        return state or {}
+
+    def save_consumer_session(self, consumer_session, return_url):
+        """
+        Stores the consumer's state in stateless mode and returns the return
+        URL that references it.
+        """
+        if not self.stateless:
+            return return_url
+        state_id = get_random_string(32)
+        self.state_cache.set(self.get_state_cache_key(state_id),
+                             dict(consumer_session), self.state_timeout)
+        return '%s%s%s=%s' % (return_url, '&' if '?' in return_url else '?',
+                              self.state_param, state_id)
+
+
+class ProviderMixin(object):
+    """
+    Bounds the time spent on OpenID providers: requests time out after
+    provider_timeout seconds and a provider failing failure_threshold times
+    in a row is given up on for recovery_timeout seconds.
+    """
+    provider_timeout = 10
+    failure_threshold = 5
+    recovery_timeout = 30
+
+    def use_fetcher(self):
+        """
+        Returns a context manager applying the view's options to the fetches
+        python-openid makes within it.
+        """
+        install_fetcher()
+        return provider_options(self.provider_timeout, self.failure_threshold,
+                                self.recovery_timeout)
+
+    def provider_available(self, url):
+        if not urlparse(url).hostname:
+            return True
+        breaker = get_provider_breaker(url, self.failure_threshold,
+                                       self.recovery_timeout)
+        return not breaker.is_open()
+
+
+class Begin(generic.FormView, ReturnUrlMixin, StoreMixin, ProviderMixin,
+            ConsumerStateMixin, RateLimitMixin):
     form_class = OpenIDForm
     sreg_attrs = {}
     ax_attrs = []
-    store_class = DjangoOpenIDStore
     trust_root = '/'
+    discovery_timeout = 60 * 5
+    discovery_failure_timeout = 60
+    discovery_cache_alias = 'default'
 
     def form_valid(self, form):
+        if self.rate_limited():
+            return self.rate_limit_exceeded()
         openid_url = form.cleaned_data['openid_url']
         return_url = self.get_return_url()
         return self.ask_openid(openid_url, return_url)
@@ -51,17 +171,43 @@ class Begin(generic.FormView, ReturnUrlMixin):
     def get_ax_attrs(self):
         return self.ax_attrs
 
+    def discover(self, openid_url):
+        """
+        Runs OpenID discovery once per request, the result is shared by the
+        consumer and the extensions detection.
+        """
+        if not hasattr(self, '_discovered'):
+            self._discovered = {}
+        if openid_url not in self._discovered:
+            self._discovered[openid_url] = cached_discover(
+                openid_url, self.discovery_timeout,
+                self.discovery_failure_timeout, sender=self.__class__,
+                cache_alias=self.discovery_cache_alias,
+            )
+        return self._discovered[openid_url]
+
     def ask_openid(self, openid_url, return_url):
+        if not self.provider_available(openid_url):
+            return self.failure(_('The OpenID provider is unavailable'))
+
         trust_root = self.get_trust_root()
-        consumer = Consumer(self.request.session, self.store_class())
+        consumer_session = self.new_consumer_session()
+        consumer = Consumer(consumer_session, self.get_store())
+        consumer._discover = self.discover
 
         try:
-            auth_request = consumer.begin(openid_url)
-        except DiscoveryFailure:
+            with self.use_fetcher():
+                with timed(openid_timing, self.__class__, phase='begin'):
+                    auth_request = consumer.begin(openid_url)
+                claimed_id, services = self.discover(openid_url)
+        except (DiscoveryFailure, fetchers.HTTPFetchingError):
             message = _('The OpenID %(url)s was invalid')
             return self.failure(message % {'url': openid_url})
+        # The identifier may delegate to a provider on another host
+        if not self.provider_available(auth_request.endpoint.server_url):
+            return self.failure(_('The OpenID provider is unavailable'))
 
-        use_ax, use_sreg = discover_extensions(openid_url)
+        use_ax, use_sreg = discover_extensions(openid_url, services)
         sreg_request = None
         ax_request = None
         if use_sreg:
@@ -90,6 +236,7 @@ class Begin(generic.FormView, ReturnUrlMixin):
             auth_request.addExtension(sreg_request)
         if ax_request is not None:
             auth_request.addExtension(ax_request)
+        return_url = self.save_consumer_session(consumer_session, return_url)
         redirect_url = auth_request.redirectURL(trust_root, return_url)
         return redirect(redirect_url)
 
@@ -102,7 +249,17 @@ class BadOpenIDStatus(Exception):
     pass
 
 
-class Callback(generic.View, ReturnUrlMixin):
+class Callback(generic.View, ReturnUrlMixin, StoreMixin, ProviderMixin,
+               ConsumerStateMixin):
+    max_openids = 10
+
+    def get_max_openids(self):
+        """
+        How many OpenIDs are kept in the session. The least recently used
+        ones are dropped first. None keeps them all.
+        """
+        return self.max_openids
+
     def success(self):
         """
         Gets called when the OpenID authentication is successful.
@@ -118,22 +275,29 @@ class Callback(generic.View, ReturnUrlMixin):
                                   "of failure()")
 
     def get(self, request, *args, **kwargs):
-        consumer = Consumer(request.session, DjangoOpenIDStore())
-        query = dict((k, smart_unicode(v)) for k, v in request.GET.items())
-        openid_response = consumer.complete(query, self.get_return_url())
+        query = dict((k, force_text(v)) for k, v in request.GET.items())
+        endpoint = query.get('openid.op_endpoint')
+        if endpoint and not self.provider_available(endpoint):
+            return self.failure(_('The OpenID provider is unavailable'))
+
+        consumer = Consumer(self.load_consumer_session(), self.get_store())
+        try:
+            with self.use_fetcher(), timed(openid_timing, self.__class__,
+                                           phase='complete') as timing:
+                openid_response = consumer.complete(query,
+                                                    self.get_return_url())
+                timing.outcome = openid_response.status
+        except fetchers.HTTPFetchingError:
+            return self.failure(_('The OpenID provider is unavailable'))
         self.openid_response = openid_response
 
         if openid_response.status == SUCCESS:
-            if 'openids' not in request.session.keys():
-                request.session['openids'] = []
-            request.session['openids'] = filter(
-                lambda o: o.openid != openid_response.identity_url,
-                request.session['openids'],
-            )
-            request.session['openids'].append(
-                from_openid_response(openid_response),
+            openids = load_openids(request.session.get('openids'))
+            request.session['openids'] = remember_openid(
+                openids, from_openid_response(openid_response),
+                self.get_max_openids(),
             )
-            OpenIDMiddleware().process_request(request)
+            set_openids(request)
             return self.success()
         elif openid_response.status == CANCEL:
             return self.failure(_('The request was cancelled'))
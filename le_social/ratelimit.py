@@ -0,0 +1,90 @@
+import time
+
+from hashlib import md5
+
+from django.http import HttpResponse
+from django.utils.encoding import force_bytes
+
+from .utils import CacheMixin
+
+
+class RateLimiter(CacheMixin):
+    """
+    Allows ``limit`` hits per ``period`` seconds and per key, counted in
+    Django's cache so that every process shares the same state.
+
+    The window slides: the count of the previous fixed window is weighted by
+    how much of it still overlaps the last ``period`` seconds, which smooths
+    out bursts at window boundaries with two counters per key.
+    """
+    key_prefix = 'le_social.ratelimit'
+
+    def __init__(self, name, limit, period, cache_alias='default'):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.cache_alias = cache_alias
+
+    def get_cache_key(self, key, window):
+        return '%s:%s:%s:%d' % (self.key_prefix, self.name,
+                                md5(force_bytes(key)).hexdigest(), window)
+
+    def hit(self, key):
+        """
+        Counts a hit for ``key``. Returns False if the limit is exceeded.
+        """
+        now = time.time() / self.period
+        window = int(now)
+        current = self.get_cache_key(key, window)
+        self.cache.add(current, 0, self.period * 2)
+        try:
+            count = self.cache.incr(current)
+        except ValueError:  # Evicted in the meantime
+            count = 1
+            self.cache.set(current, count, self.period * 2)
+        previous = self.cache.get(self.get_cache_key(key, window - 1), 0)
+        return previous * (1 - (now - window)) + count <= self.limit
+
+
+class RateLimitMixin(object):
+    """
+    Rejects requests exceeding ``rate_limit``, a ``(limit, period)`` tuple,
+    for any of the keys listed in ``rate_limit_keys``: 'ip' for the client's
+    address or the name of a POST field. Views call ``rate_limited()``
+    before doing any expensive work.
+    """
+    rate_limit = None
+    rate_limit_keys = ('ip',)
+    rate_limit_name = None
+    rate_limit_cache_alias = 'default'
+
+    def get_rate_limit(self):
+        return self.rate_limit
+
+    def get_rate_limit_name(self):
+        if self.rate_limit_name is not None:
+            return self.rate_limit_name
+        return '%s.%s' % (self.__class__.__module__, self.__class__.__name__)
+
+    def get_rate_limit_keys(self):
+        keys = []
+        for name in self.rate_limit_keys:
+            if name == 'ip':
+                value = self.request.META.get('REMOTE_ADDR')
+            else:
+                value = self.request.POST.get(name)
+            if value:
+                keys.append('%s:%s' % (name, value.strip().lower()))
+        return keys
+
+    def rate_limited(self):
+        rate_limit = self.get_rate_limit()
+        if rate_limit is None:
+            return False
+        limiter = RateLimiter(self.get_rate_limit_name(), rate_limit[0],
+                              rate_limit[1], self.rate_limit_cache_alias)
+        allowed = [limiter.hit(key) for key in self.get_rate_limit_keys()]
+        return not all(allowed)
+
+    def rate_limit_exceeded(self):
+        return HttpResponse('Too many requests', status=429)
@@ -0,0 +1,61 @@
+import logging
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class MailDelivery(object):
+    """
+    Sends the notification right away, in the request.
+    """
+    def send(self, message):
+        message.send()
+
+
+_queue = Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _deliver():
+    while True:
+        message, attempts, delay = _queue.get()
+        try:
+            message.send()
+        except Exception:
+            logger.exception("Failed to send the notification to %s",
+                             ', '.join(message.to))
+            if attempts > 1:
+                retry = threading.Timer(delay, _queue.put, [
+                    (message, attempts - 1, delay * 2),
+                ])
+                retry.daemon = True
+                retry.start()
+        finally:
+            _queue.task_done()
+
+
+class ThreadDelivery(object):
+    """
+    Sends the notification from a background thread, so the response doesn't
+    wait for the mail server. A failed send is retried up to ``retries``
+    times, ``retry_delay`` seconds later, the delay doubling after each
+    attempt. Notifications still queued when the process exits are lost.
+    """
+    retries = 3
+    retry_delay = 10
+
+    def send(self, message):
+        global _worker
+        with _worker_lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_deliver,
+                                           name='le_social.registration')
+                _worker.daemon = True
+                _worker.start()
+        _queue.put((message, self.retries + 1, self.retry_delay))
@@ -26,11 +26,9 @@ class RegistrationForm(forms.Form):
         return self.cleaned_data
 
     def save(self):
-        user = get_user_model().objects.create_user(
+        return get_user_model().objects.create_user(
             self.cleaned_data['username'],
             self.cleaned_data['email'],
             self.cleaned_data['password1'],
+            is_active=False,
         )
-        user.is_active = False
-        user.save()
-        return user
@@ -0,0 +1,80 @@
+import sys
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import (activate_users, load_activation_keys, pending_users,
+                      purge_users)
+from ...views import Activate
+
+
+class Command(BaseCommand):
+    help = ("Activates or deletes pending registrations in batches: the "
+            "users matching a list of activation keys, or the users who "
+            "registered more than --expires-in seconds ago.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['activate', 'purge'])
+        parser.add_argument(
+            '--keys', dest='keys',
+            help="File with one activation key per line, '-' for stdin.")
+        parser.add_argument(
+            '--expires-in', type=int, dest='expires_in',
+            help="Age in seconds of the registrations to select, and maximum "
+                 "age of the activation keys (default: %d). Required to "
+                 "activate users without --keys." % Activate.expires_in)
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help="Number of rows to update or delete per statement "
+                 "(default: 1000).")
+        parser.add_argument(
+            '--sleep', type=float, default=0, dest='sleep',
+            help="Seconds to wait between two batches (default: 0).")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'activate':
+            process, verb = activate_users, 'Activated'
+        else:
+            process, verb = purge_users, 'Deleted'
+        batch_size = options['batch_size']
+        expires_in = options['expires_in']
+        if not options['keys'] and expires_in is None:
+            if options['action'] == 'activate':
+                # Activating accounts by age skips the email verification
+                raise CommandError("Pass --keys, or --expires-in to "
+                                   "activate users by age.")
+        if expires_in is None:
+            expires_in = Activate.expires_in
+
+        start = time.time()
+        try:
+            if options['keys']:
+                pks, invalid = load_activation_keys(
+                    self.read_keys(options['keys']), expires_in)
+                if invalid:
+                    self.stderr.write("Skipped %d invalid or expired "
+                                      "activation keys" % invalid)
+                count = 0
+                for i in range(0, len(pks), batch_size):
+                    users = pending_users(pks=pks[i:i + batch_size])
+                    count += process(users, batch_size, options['sleep'])
+            else:
+                users = pending_users(expires_in=expires_in)
+                count = process(users, batch_size, options['sleep'])
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        elapsed = time.time() - start
+        self.stdout.write("%s %d users in %.2fs (%.0f rows/s)" % (
+            verb, count, elapsed, count / elapsed if elapsed else 0))
+
+    def read_keys(self, path):
+        if path == '-':
+            lines = sys.stdin.readlines()
+        else:
+            try:
+                with open(path) as f:
+                    lines = f.readlines()
+            except IOError as e:
+                raise CommandError(e)
+        return [line.strip() for line in lines if line.strip()]
@@ -1,10 +1,32 @@
-from django.contrib.auth.models import User
+import time
+
+from datetime import timedelta
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
 from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import call_command, CommandError
 try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.template.loader import get_template
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from mock import patch
+
+from ..forms import RegistrationForm
+from ..utils import (activate_users, make_activation_key, pending_users,
+                     purge_users)
+from ..views import Register
 
 
 class RegistrationTest(TestCase):
@@ -73,6 +95,84 @@ class RegistrationTest(TestCase):
         self.assertEqual(len(response.redirect_chain), 1)
         self.assertEqual(len(mail.outbox), 0)
 
+    def wait_for(self, condition):
+        for i in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("Timed out")
+
+    def test_register_in_background(self):
+        url = reverse('registration_register_in_background')
+        response = self.client.post(url, self.valid_data)
+        self.assertEqual(response.status_code, 302)
+        self.wait_for(lambda: len(mail.outbox) == 1)
+        self.assertEqual(mail.outbox[0].to, ['foo@example.com'])
+
+    @patch('le_social.registration.delivery.logger')
+    def test_background_retry(self, logger):
+        url = reverse('registration_register_in_background')
+        with patch.object(EmailMessage, 'send',
+                          side_effect=[IOError('Connection refused'), 1]
+                          ) as send:
+            self.client.post(url, self.valid_data)
+            self.wait_for(lambda: send.call_count == 2)
+        self.assertEqual(logger.exception.call_count, 1)
+
+    def test_cached_templates(self):
+        url = reverse('registration_register')
+        self.addCleanup(Register._templates.clear)
+        Register._templates.clear()
+        with patch('le_social.registration.views.get_template',
+                   side_effect=get_template) as load:
+            self.client.post(url, self.valid_data)
+            self.client.post(url, dict(self.valid_data, username='other'))
+            self.assertEqual(load.call_count, 2)
+
+            with override_settings(DEBUG=True):
+                self.client.post(url, dict(self.valid_data, username='a'))
+            self.assertEqual(load.call_count, 4)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_templates_setting_changed(self):
+        url = reverse('registration_register')
+        self.addCleanup(Register._templates.clear)
+        self.client.post(url, self.valid_data)
+        self.assertTrue(Register._templates)
+
+        templates = [dict(settings.TEMPLATES[0], DIRS=[])]
+        with override_settings(TEMPLATES=templates):
+            self.assertEqual(Register._templates, {})
+
+    def test_html_notification(self):
+        url = reverse('registration_register_with_html')
+        self.client.post(url, self.valid_data)
+        self.assertEqual(len(mail.outbox), 1)
+        html, mimetype = mail.outbox[0].alternatives[0]
+        self.assertEqual(mimetype, 'text/html')
+        self.assertIn('<a href="http://testserver/activate/', html)
+        self.assertIn('testserver/activate/', mail.outbox[0].body)
+
+    def test_build_notification(self):
+        view = Register(notification_html_template_name=(
+            'le_social/registration/activation_email.html'))
+        view.request = RequestFactory().post('/register/')
+        view.user = User.objects.create_user('foo', 'foo@example.com')
+        view.activation_key = make_activation_key(view.user)
+        message = view.build_notification()
+        self.assertEqual(message.to, ['foo@example.com'])
+        self.assertIn(view.activation_key, message.body)
+        html, mimetype = message.alternatives[0]
+        self.assertEqual(mimetype, 'text/html')
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_single_insert(self):
+        form = RegistrationForm(self.valid_data)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(1):
+            user = form.save()
+        self.assertFalse(User.objects.get(pk=user.pk).is_active)
+
     def test_activate(self):
         url = reverse('registration_register')
         response = self.client.post(url, self.valid_data)
@@ -98,3 +198,92 @@ class RegistrationTest(TestCase):
         url = mail.outbox[0].body.split('testserver')[1].split('\n')[0]
         response = self.client.get(url)
         self.assertContains(response, 'Invalid')
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.users = []
+        for i, days in enumerate((0, 10, 40, 50)):
+            self.users.append(User.objects.create_user(
+                'user%d' % i, 'user%d@example.com' % i, 'foo',
+                is_active=False, date_joined=now - timedelta(days=days)))
+        User.objects.create_user('active', 'active@example.com', 'foo',
+                                 date_joined=now - timedelta(days=60))
+        User.objects.create_user('banned', 'banned@example.com', 'foo',
+                                 is_active=False, last_login=now,
+                                 date_joined=now - timedelta(days=60))
+
+    def test_pending_users(self):
+        self.assertEqual(pending_users().count(), 4)
+        expired = pending_users(expires_in=60 * 60 * 24 * 30)
+        self.assertEqual(sorted(expired.values_list('username', flat=True)),
+                         ['user2', 'user3'])
+
+        self.assertEqual(purge_users(expired, batch_size=1), 2)
+        self.assertEqual(activate_users(pending_users()), 2)
+        self.assertEqual(User.objects.filter(is_active=True).count(), 3)
+        self.assertEqual(User.objects.count(), 4)
+
+    def call(self, *args, **kwargs):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('registration_batch', *args, stdout=stdout,
+                     stderr=stderr, **kwargs)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_activate_keys(self):
+        keys = [make_activation_key(user) for user in self.users[:2]]
+        keys.append('invalid')
+        with patch('sys.stdin', StringIO('\n'.join(keys))):
+            stdout, stderr = self.call('activate', keys='-')
+        self.assertIn('Activated 2 users', stdout)
+        self.assertIn('Skipped 1 invalid', stderr)
+        self.assertEqual(
+            sorted(User.objects.filter(
+                username__startswith='user', is_active=True,
+            ).values_list('username', flat=True)),
+            ['user0', 'user1'])
+
+    def test_purge_expired(self):
+        stdout, stderr = self.call('purge', expires_in=60 * 60 * 24 * 5)
+        self.assertIn('Deleted 3 users', stdout)
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_activate_requires_selection(self):
+        with self.assertRaises(CommandError):
+            self.call('activate')
+        self.assertFalse(User.objects.filter(username__startswith='user',
+                                             is_active=True).exists())
+        stdout, stderr = self.call('activate', expires_in=60 * 60 * 24 * 45)
+        self.assertIn('Activated 1 users', stdout)
+
+    @patch('le_social.registration.utils.get_user_model', lambda: Group)
+    def test_missing_fields(self):
+        with self.assertRaises(CommandError) as context:
+            self.call('purge')
+        self.assertIn('Group has no is_active field', str(context.exception))
+        keys = StringIO(make_activation_key(self.users[0]))
+        with self.assertRaises(CommandError), patch('sys.stdin', keys):
+            self.call('activate', keys='-')
+
+
+class RegisterRateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch.object(Register, 'rate_limit', (1, 60))
+    @patch.object(Register, 'rate_limit_keys', ('ip', 'email'))
+    def test_register(self):
+        url = reverse('registration_register')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        data = RegistrationTest.valid_data
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        response = self.client.post(url, dict(data, username='other'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        response = self.client.post(url, dict(data, username='third',
+                                              email='bar@example.com'),
+                                    REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 302)
@@ -18,6 +18,12 @@ urlpatterns = [
     url(r'^register-no-notify/$', views.register_with_no_notification,
         name='registration_register_with_notification'),
 
+    url(r'^register-in-background/$', views.register_in_background,
+        name='registration_register_in_background'),
+
+    url(r'^register-html/$', views.register_with_html,
+        name='registration_register_with_html'),
+
     url(r'^register-closed/$', views.register_but_closed,
         name='registration_register_but_closed'),
 
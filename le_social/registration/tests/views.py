@@ -1,4 +1,4 @@
-from .. import views
+from .. import delivery, views
 
 activation_complete = views.ActivationComplete.as_view()
 registration_complete = views.RegistrationComplete.as_view()
@@ -11,6 +11,18 @@ class NoNotificationRegistration(views.Register):
         return
 register_with_no_notification = NoNotificationRegistration.as_view()
 
+
+class InstantRetryDelivery(delivery.ThreadDelivery):
+    retry_delay = 0
+register_in_background = views.Register.as_view(
+    delivery_class=InstantRetryDelivery,
+)
+
+register_with_html = views.Register.as_view(
+    notification_html_template_name=('le_social/registration/'
+                                     'activation_email.html'),
+)
+
 register_but_closed = views.Register.as_view(registration_closed=True)
 activate = views.Activate.as_view()
 
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+try:
+    from django.core.exceptions import FieldDoesNotExist
+except ImportError:
+    from django.db.models.fields import FieldDoesNotExist
+
+from ..utils import delete_in_batches, get_user_model, update_in_batches
+
+SALT = 'le_social.registration'
+
+
+def make_activation_key(user):
+    return signing.dumps(user.pk, salt=SALT)
+
+
+def load_activation_key(activation_key, max_age=None):
+    """
+    Returns the primary key of the user an activation key was issued for.
+    Raises ``signing.BadSignature`` if the key is invalid or older than
+    ``max_age`` seconds.
+    """
+    return signing.loads(activation_key, max_age=max_age, salt=SALT)
+
+
+def pending_users(pks=None, expires_in=None):
+    """
+    Returns the users who registered but never activated their account:
+    inactive and never logged in. ``pks`` restricts them to a list of primary
+    keys and ``expires_in`` to the users who joined more than ``expires_in``
+    seconds ago.
+
+    The user model needs ``is_active`` and ``last_login`` fields, and a
+    ``date_joined`` field for ``expires_in``. ``ImproperlyConfigured`` is
+    raised otherwise.
+    """
+    model = get_user_model()
+    fields = ['is_active', 'last_login']
+    if expires_in is not None:
+        fields.append('date_joined')
+    for name in fields:
+        try:
+            model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(
+                "%s has no %s field, pending users can't be selected%s." % (
+                    model._meta.object_name, name,
+                    ' by age' if name == 'date_joined' else ''))
+    users = model._default_manager.filter(
+        is_active=False, last_login__isnull=True)
+    if pks is not None:
+        users = users.filter(pk__in=pks)
+    if expires_in is not None:
+        joined = timezone.now() - timedelta(seconds=expires_in)
+        users = users.filter(date_joined__lt=joined)
+    return users
+
+
+def activate_users(users, batch_size=1000, sleep=0):
+    """
+    Activates ``users`` in batches of ``batch_size`` rows. Returns the
+    number of activated users.
+    """
+    return update_in_batches(users, {'is_active': True}, batch_size, sleep)
+
+
+def purge_users(users, batch_size=1000, sleep=0):
+    """
+    Deletes ``users`` in batches of ``batch_size`` rows. Returns the number
+    of deleted users.
+    """
+    return delete_in_batches(users, batch_size, sleep)
+
+
+def load_activation_keys(activation_keys, max_age=None):
+    """
+    Verifies a list of activation keys and returns the primary keys of their
+    users, along with the number of invalid or expired keys.
+    """
+    pks = []
+    invalid = 0
+    for activation_key in activation_keys:
+        try:
+            pks.append(load_activation_key(activation_key, max_age))
+        except signing.BadSignature:
+            invalid += 1
+    return pks, invalid
@@ -1,18 +1,24 @@
 from django.conf import settings
 from django.contrib.sites.requests import RequestSite
 from django.core import signing
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
+from django.core.signals import setting_changed
 try:
     from django.urls import reverse_lazy
 except ImportError:
     from django.core.urlresolvers import reverse_lazy
 from django.shortcuts import redirect
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from django.utils.encoding import force_text
+from django.utils.module_loading import import_string
+from django.dispatch import receiver
 from django.views import generic
 
+from ..ratelimit import RateLimitMixin
 from ..utils import get_user_model
+from .delivery import MailDelivery
 from .forms import RegistrationForm
+from .utils import load_activation_key, make_activation_key
 
 
 class ActivationComplete(generic.TemplateView):
@@ -26,9 +32,8 @@ class Activate(generic.TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
         try:
-            self.activation_key = signing.loads(kwargs['activation_key'],
-                                                max_age=self.get_expires_in(),
-                                                salt='le_social.registration')
+            self.activation_key = load_activation_key(
+                kwargs['activation_key'], self.get_expires_in())
         except signing.BadSignature:
             return super(Activate, self).dispatch(request, *args, **kwargs)
         self.request = request
@@ -48,7 +53,7 @@ class Activate(generic.TemplateView):
             pk=self.activation_key).update(is_active=True)
 
 
-class Register(generic.FormView):
+class Register(generic.FormView, RateLimitMixin):
     closed_url = reverse_lazy('registration_closed')
     form_class = RegistrationForm
     registration_closed = False
@@ -57,10 +62,15 @@ class Register(generic.FormView):
     notification_template_name = 'le_social/registration/activation_email.txt'
     notification_subject_template_name = ('le_social/registration/'
                                           'activation_email_subject.txt')
+    notification_html_template_name = None
+    delivery_class = None
+    _templates = {}
 
     def dispatch(self, request, *args, **kwargs):
         if self.get_registration_closed():
             return redirect(self.get_closed_url())
+        if request.method == 'POST' and self.rate_limited():
+            return self.rate_limit_exceeded()
         return super(Register, self).dispatch(request, *args, **kwargs)
 
     def get_registration_closed(self):
@@ -71,8 +81,7 @@ class Register(generic.FormView):
 
     def form_valid(self, form):
         self.user = form.save()
-        self.activation_key = signing.dumps(self.user.pk,
-                                            salt='le_social.registration')
+        self.activation_key = make_activation_key(self.user)
         self.send_notification()
         return super(Register, self).form_valid(form)
 
@@ -83,15 +92,57 @@ class Register(generic.FormView):
             'site': RequestSite(self.request),
         }
 
-    def send_notification(self):
+    def get_delivery_class(self):
+        if self.delivery_class is not None:
+            return self.delivery_class
+        if hasattr(settings, 'REGISTRATION_DELIVERY'):
+            return import_string(settings.REGISTRATION_DELIVERY)
+        return MailDelivery
+
+    def get_delivery(self):
+        return self.get_delivery_class()()
+
+    def get_notification_template(self, template_name):
+        """
+        Returns a compiled notification template. Templates are loaded once
+        per process and shared by all Register views, unless DEBUG is on.
+        The cache is cleared when the TEMPLATES setting changes.
+        """
+        if settings.DEBUG:
+            return get_template(template_name)
+        if template_name not in self._templates:
+            self._templates[template_name] = get_template(template_name)
+        return self._templates[template_name]
+
+    def render_notification(self, template_name, context):
+        return self.get_notification_template(template_name).render(context)
+
+    def build_notification(self):
         context = self.get_notification_context()
-        send_mail(
-            render_to_string(self.notification_subject_template_name,
-                             context).strip(),
-            render_to_string(self.notification_template_name, context),
+        message = EmailMultiAlternatives(
+            self.render_notification(self.notification_subject_template_name,
+                                     context).strip(),
+            self.render_notification(self.notification_template_name,
+                                     context),
             settings.DEFAULT_FROM_EMAIL,
             [self.user.email],
         )
+        if self.notification_html_template_name is not None:
+            message.attach_alternative(
+                self.render_notification(
+                    self.notification_html_template_name, context),
+                'text/html',
+            )
+        return message
+
+    def send_notification(self):
+        self.get_delivery().send(self.build_notification())
+
+
+@receiver(setting_changed)
+def clear_notification_templates(setting, **kwargs):
+    if setting == 'TEMPLATES':
+        Register._templates.clear()
 
 
 class RegistrationComplete(generic.TemplateView):
@@ -1,6 +1,8 @@
 import os
 import warnings
 
+import django
+
 warnings.simplefilter('always')
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -29,9 +31,12 @@ MIDDLEWARE = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
 )
+if django.VERSION < (2, 0):  # Removed in Django 2.0
+    MIDDLEWARE += (
+        'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    )
 MIDDLEWARE_CLASSES = MIDDLEWARE  # Django < 1.10
 
 ROOT_URLCONF = 'le_social.registration.tests.urls'
@@ -52,3 +57,5 @@ TEMPLATES = [{
 }]
 
 SITE_ID = 1
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from django.test import TestCase
+from mock import patch
+
+from ..ratelimit import RateLimiter
+
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch('le_social.ratelimit.time.time')
+    def test_sliding_window(self, now):
+        limiter = RateLimiter('test', 2, 60)
+        now.return_value = 6000
+        self.assertTrue(limiter.hit('a'))
+        self.assertTrue(limiter.hit('a'))
+        self.assertFalse(limiter.hit('a'))
+        self.assertTrue(limiter.hit('b'))
+
+        # 3 hits in the previous window, weighted by 2/3
+        now.return_value = 6080
+        self.assertFalse(limiter.hit('a'))
+        now.return_value = 6170
+        self.assertTrue(limiter.hit('a'))
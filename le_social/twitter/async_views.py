@@ -0,0 +1,18 @@
+"""
+Async versions of the Twitter views, for Django 3.1+ served over ASGI.
+
+The OAuth requests run, along with the session handling, in a bounded
+thread pool so that a slow Twitter doesn't block the event loop.
+"""
+from ..async_utils import ThreadPoolMixin
+from . import views
+
+
+class Authorize(ThreadPoolMixin, views.Authorize):
+    async def get(self, request, *args, **kwargs):
+        return await self.run_in_pool(super().get, request, *args, **kwargs)
+
+
+class Callback(ThreadPoolMixin, views.Callback):
+    async def get(self, request, *args, **kwargs):
+        return await self.run_in_pool(super().get, request, *args, **kwargs)
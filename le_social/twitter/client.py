@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+
+import errno
+import socket
+import threading
+
+try:
+    from http.client import BadStatusLine, HTTPException, HTTPSConnection
+    from queue import Empty, Full, LifoQueue
+except ImportError:
+    from httplib import BadStatusLine, HTTPException, HTTPSConnection
+    from Queue import Empty, Full, LifoQueue
+
+from django.core.exceptions import ImproperlyConfigured
+
+from ..circuitbreaker import CircuitBreaker
+
+try:
+    from twitter import OAuth, TwitterError
+    from twitter.oauth_dance import parse_oauth_tokens
+except ImportError:
+    raise ImproperlyConfigured(
+        "twitter<1.8 is required to use le_social.twitter."
+    )
+
+
+class TwitterClientError(TwitterError):
+    def __init__(self, message, status=None):
+        super(TwitterClientError, self).__init__(message)
+        self.status = status
+
+
+def is_closed_connection_error(error):
+    """
+    Whether ``error`` means that the server closed an idle keep-alive
+    connection. Timeouts don't.
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, BadStatusLine):  # Includes RemoteDisconnected
+        return True
+    return getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class TwitterClient(object):
+    """
+    Runs the OAuth requests against api.twitter.com over a pool of
+    persistent HTTPS connections. Instances are thread-safe.
+
+    Requests time out after ``timeout`` seconds. After ``failure_threshold``
+    consecutive network errors or 5xx responses, requests fail immediately
+    for ``recovery_timeout`` seconds.
+    """
+    host = 'api.twitter.com'
+
+    def __init__(self, consumer_key, consumer_secret, timeout=10,
+                 pool_size=10, failure_threshold=5, recovery_timeout=30):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.timeout = timeout
+        self.connections = LifoQueue(maxsize=pool_size)
+        self.breaker = CircuitBreaker('twitter', failure_threshold,
+                                      recovery_timeout)
+
+    def new_connection(self):
+        return HTTPSConnection(self.host, timeout=self.timeout)
+
+    def get_connection(self):
+        """
+        Returns an idle connection from the pool and whether it has already
+        been used.
+        """
+        try:
+            return self.connections.get_nowait(), True
+        except Empty:
+            return self.new_connection(), False
+
+    def release_connection(self, connection):
+        try:
+            self.connections.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def request(self, path, token='', token_secret='', **params):
+        """
+        Sends a signed GET request and returns the status and body of the
+        response.
+        """
+        params = dict((k, v) for k, v in params.items() if v is not None)
+        oauth = OAuth(token, token_secret, self.consumer_key,
+                      self.consumer_secret)
+        query = oauth.encode_params('https://%s%s' % (self.host, path), 'GET',
+                                    params)
+        if self.breaker.is_open():
+            raise TwitterClientError('Twitter is unavailable')
+        connection, reused = self.get_connection()
+        while True:
+            try:
+                connection.request('GET', '%s?%s' % (path, query))
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (socket.error, HTTPException) as e:
+                connection.close()
+                if reused and is_closed_connection_error(e):
+                    # The server closed an idle keep-alive connection, retry
+                    # once over a new one.
+                    connection, reused = self.new_connection(), False
+                    continue
+                self.breaker.record_failure()
+                raise TwitterClientError(str(e))
+        if response.will_close:
+            connection.close()
+        else:
+            self.release_connection(connection)
+        if response.status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response.status, body.decode('utf-8')
+
+    def get_tokens(self, path, token='', token_secret='', **params):
+        status, body = self.request(path, token, token_secret, **params)
+        if status != 200:
+            raise TwitterClientError(body, status)
+        return parse_oauth_tokens(body)
+
+    def request_token(self, callback=None):
+        """
+        Returns a (token, token_secret) tuple.
+        """
+        return self.get_tokens('/oauth/request_token',
+                               oauth_callback=callback)
+
+    def access_token(self, token, token_secret, verifier):
+        """
+        Exchanges a request token for an access token and returns an OAuth
+        object ready to be used with the Twitter API.
+        """
+        oauth = OAuth(token, token_secret, self.consumer_key,
+                      self.consumer_secret)
+        oauth.token, oauth.token_secret = self.get_tokens(
+            '/oauth/access_token', token, token_secret,
+            oauth_verifier=verifier)
+        return oauth
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(consumer_key, consumer_secret, **options):
+    """
+    Returns a process-wide TwitterClient for the given credentials and
+    options.
+    """
+    key = (consumer_key, consumer_secret) + tuple(sorted(options.items()))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = TwitterClient(consumer_key, consumer_secret,
+                                          **options)
+        return _clients[key]
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+try:
+    from twitter import TwitterError
+except ImportError:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured(
+        "twitter<1.8 is required to use le_social.twitter."
+    )
+
+
+class Command(BaseCommand):
+    help = "Fills the pool of pre-issued Twitter request tokens."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--view', default='le_social.twitter.views.Authorize',
+            dest='view',
+            help="Dotted path to the Authorize view whose credentials and "
+                 "pool settings to use (default: %(default)s).")
+        parser.add_argument(
+            '--size', type=int, dest='size',
+            help="Number of tokens to keep in the pool (default: the view's "
+                 "token_pool_size).")
+
+    def handle(self, *args, **options):
+        view = import_string(options['view'])()
+        try:
+            added = view.fill_token_pool(options['size'])
+        except TwitterError as e:
+            raise CommandError("Failed to get a request token: %s" % e)
+        self.stdout.write("Added %d request tokens, %d in the pool" % (
+            added, len(view.get_token_pool())))
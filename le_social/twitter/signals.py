@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent after each request to Twitter by the Authorize and Callback views.
+# Arguments: ``phase`` ('request_token' or 'access_token'), ``duration`` (in
+# seconds), ``outcome`` ('success' or 'failure'), ``status`` (the HTTP status
+# of Twitter's response, if any) and ``error`` (the message passed to
+# ``error()``, if any).
+twitter_timing = Signal()
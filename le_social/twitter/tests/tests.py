@@ -1,12 +1,21 @@
 from __future__ import absolute_import
 
+import errno
+import socket
+
 try:
     from unittest import skipIf
 except ImportError:
     from django.utils.unittest import skipIf
 
+import django
+
 try:
     import twitter.oauth_dance
+    from ..client import TwitterClient
+    from ..signals import twitter_timing
+    from ..tokens import RequestTokenPool
+    from .. import views
 except ImportError:
     twitter = None
 
@@ -14,26 +23,14 @@ try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from mock import patch
 
 
-def parse_oauth_tokens(tokens):
-    return tokens
-
-
-def side_effect(tokens):
-    yield tokens
-
-
-class OAuth(object):
-    def request_token(self, oauth_callback):
-        return 'token', 'token_secret'
-
-    def access_token(self, oauth_verifier):
-        return 'Yay', 'access token'
-
-
 class Account(object):
     def verify_credentials(self):
         return {'screen_name': 'brutasse'}
@@ -43,31 +40,68 @@ class Twitter(object):
     def __init__(self, **kwargs):
         for key in kwargs:
             setattr(self, key, kwargs[key])
-        self.oauth = OAuth()
         self.account = Account()
 
 
-class TwitterTest(TestCase):
-    urls = 'le_social.twitter.tests.urls'
+class Response(object):
+    """
+    Fake HTTP response
+    """
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.will_close = False
 
-    def setUp(self):
-        self._old_twitter = twitter.Twitter
-        twitter.Twitter = Twitter
+    def read(self):
+        return self.body
+
+
+class Connection(object):
+    """
+    Fake HTTPS connection
+    """
+    instances = []
+
+    def __init__(self, host, timeout):
+        self.requests = []
+        self.instances.append(self)
+
+    def request(self, method, url):
+        self.requests.append((method, url))
+
+    def getresponse(self):
+        if '/oauth/access_token' in self.requests[-1][1]:
+            return Response(200, b'oauth_token=Yay&oauth_token_secret=s')
+        return Response(200, b'oauth_token=token&oauth_token_secret=secret')
 
-    def tearDown(self):
-        twitter.Twitter = self._old_twitter
+    def close(self):
+        pass
 
-    @patch('twitter.oauth_dance.parse_oauth_tokens')
-    def test_authorize(self, parse):
-        parse.side_effect = side_effect()
-        url = reverse('authorize')
+
+class TwitterTests(object):
+    authorize_url = 'authorize'
+    callback_url = 'callback'
+
+    def setUp(self):
+        cache.clear()
+        Connection.instances = []
+        patchers = [
+            patch('twitter.Twitter', Twitter),
+            patch('le_social.twitter.client.HTTPSConnection', Connection),
+            patch.dict('le_social.twitter.client._clients', clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_authorize(self):
+        url = reverse(self.authorize_url)
         response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
+        self.assertIn('oauth_token=token', response['Location'])
 
-    @patch('twitter.oauth_dance.parse_oauth_tokens')
-    def test_callback(self, parse):
-        parse.side_effect = side_effect()
-        url = reverse('callback')
+    def test_callback(self):
+        url = reverse(self.callback_url)
         response = self.client.get(url)
         self.assertContains(response, "No verifier code")
 
@@ -75,7 +109,225 @@ class TwitterTest(TestCase):
         response = self.client.get(url)
         self.assertContains(response, "No request token found in the session")
 
-        self.client.get(reverse('authorize'))
+        self.client.get(reverse(self.authorize_url))
         response = self.client.get(url)
         self.assertContains(response, 'brutasse')
+
+    @patch('le_social.twitter.views.OAuthMixin.use_token_cookie', True)
+    def test_token_cookie(self):
+        response = self.client.get(reverse(self.authorize_url))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('twitter_request_token', response.cookies)
+
+        cookie = self.client.cookies['twitter_request_token'].value
+        url = reverse(self.callback_url) + '?oauth_verifier=foo'
+        response = self.client.get(url + '&oauth_token=other')
+        self.assertContains(response, 'No valid request token found')
+        self.assertEqual(response.cookies['twitter_request_token'].value, '')
+
+        self.client.cookies['twitter_request_token'] = cookie
+        response = self.client.get(url + '&oauth_token=token')
+        self.assertContains(response, 'brutasse')
+        self.assertEqual(response.cookies['twitter_request_token'].value, '')
+        self.assertEqual(Session.objects.count(), 0)
+
+        # The secret can only be used once
+        self.client.cookies['twitter_request_token'] = cookie
+        response = self.client.get(url + '&oauth_token=token')
+        self.assertContains(response, 'No valid request token found')
+
+    @patch('le_social.twitter.views.OAuthMixin.use_token_cookie', True)
+    @patch('le_social.twitter.views.OAuthMixin.token_cookie_cache_alias',
+           'tokens')
+    def test_token_cookie_cache_alias(self):
+        with override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'tokens': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tokens',
+            },
+        }):
+            self.client.get(reverse(self.authorize_url))
+            key = views.OAuthMixin().get_token_cache_key('token')
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(caches['tokens'].get(key), 'secret')
+
+    def test_connection_reuse(self):
+        self.client.get(reverse(self.authorize_url))
+        self.client.get(reverse(self.callback_url) + '?oauth_verifier=foo')
+        self.assertEqual(len(Connection.instances), 1)
+        self.assertEqual(len(Connection.instances[0].requests), 2)
+
+    def test_rate_limit(self):
+        url = reverse(self.authorize_url)
+        with patch('le_social.twitter.views.Authorize.rate_limit', (1, 60)):
+            self.assertEqual(self.client.get(url).status_code, 302)
+            self.assertEqual(self.client.get(url).status_code, 429)
+        self.assertEqual(len(Connection.instances), 1)
+
+    def test_token_pool(self):
+        timings = []
+
+        def receiver(sender, phase, **kwargs):
+            timings.append(phase)
+        twitter_timing.connect(receiver)
+        self.addCleanup(twitter_timing.disconnect, receiver)
+
+        with patch('sys.stdout'):
+            call_command('twitter_token_pool', size=2,
+                         view='le_social.twitter.tests.views.Authorize')
+        self.assertEqual(len(Connection.instances[0].requests), 2)
+        self.assertEqual(timings, ['request_token'] * 2)
+        url = reverse(self.authorize_url)
+        with patch('le_social.twitter.views.Authorize.use_token_pool', True):
+            for i in range(3):
+                response = self.client.get(url)
+                self.assertIn('oauth_token=token', response['Location'])
+        self.assertEqual(len(Connection.instances[0].requests), 3)
+        # Tokens taken from the pool aren't Twitter calls
+        self.assertEqual(timings, ['request_token'] * 3)
+
+    def test_timing_signal(self):
+        timings = []
+
+        def receiver(sender, phase, duration, outcome, status, error,
+                     **kwargs):
+            timings.append((phase, outcome, status, error))
+        twitter_timing.connect(receiver)
+        self.addCleanup(twitter_timing.disconnect, receiver)
+
+        self.client.get(reverse(self.authorize_url))
+        url = reverse(self.callback_url) + '?oauth_verifier=foo'
+        with patch.object(Connection, 'getresponse',
+                          return_value=Response(401, b'Nope')):
+            response = self.client.get(url)
+        self.assertContains(response, 'Failed to get an access token')
+        self.assertEqual(timings, [
+            ('request_token', 'success', 200, None),
+            ('access_token', 'failure', 401,
+             'Failed to get an access token'),
+        ])
+
+
+@override_settings(ROOT_URLCONF='le_social.twitter.tests.urls')
+class TwitterTest(TwitterTests, TestCase):
+    pass
 TwitterTest = skipIf(twitter is None, "twitter not installed")(TwitterTest)
+
+
+@skipIf(twitter is None, "twitter not installed")
+@skipIf(django.VERSION < (3, 1), "async views require Django 3.1")
+@override_settings(ROOT_URLCONF='le_social.twitter.tests.urls')
+class AsyncTwitterTest(TwitterTests, TransactionTestCase):
+    """
+    The views run in a thread pool, so the session queries need to see the
+    test data without an enclosing transaction.
+    """
+    authorize_url = 'async_authorize'
+    callback_url = 'async_callback'
+
+
+class BrokenConnection(Connection):
+    def getresponse(self):
+        raise socket.timeout('timed out')
+
+
+class ClosedConnection(Connection):
+    def getresponse(self):
+        raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+
+
+class ClientTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = patch('le_social.twitter.client.HTTPSConnection',
+                        Connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tokens(self):
+        client = TwitterClient('key', 'secret')
+        self.assertEqual(client.request_token(), ('token', 'secret'))
+        oauth = client.access_token('token', 'secret', 'verifier')
+        self.assertEqual((oauth.token, oauth.token_secret), ('Yay', 's'))
+
+    def test_error(self):
+        client = TwitterClient('key', 'secret')
+        with patch.object(client, 'request', return_value=(401, 'Nope')):
+            with self.assertRaises(twitter.TwitterError) as context:
+                client.request_token()
+        self.assertEqual(context.exception.status, 401)
+
+    def test_circuit_breaker(self):
+        client = TwitterClient('key', 'secret', failure_threshold=2)
+        Connection.instances = []
+        with patch('le_social.twitter.client.HTTPSConnection',
+                   BrokenConnection):
+            for i in range(3):
+                with self.assertRaises(twitter.TwitterError):
+                    client.request_token()
+        self.assertEqual(len(Connection.instances), 2)
+
+        client.breaker.record_success()
+        cache.delete(client.breaker.open_key)
+        self.assertEqual(client.request_token(), ('token', 'secret'))
+
+    def test_closed_connections(self):
+        client = TwitterClient('key', 'secret')
+        for i in range(3):
+            client.release_connection(ClosedConnection('api.twitter.com', 1))
+        Connection.instances = []
+        self.assertEqual(client.request_token(), ('token', 'secret'))
+        # One closed connection, then a new one
+        self.assertEqual(len(Connection.instances), 1)
+        self.assertEqual(client.connections.qsize(), 3)
+
+    def test_pooled_timeouts(self):
+        client = TwitterClient('key', 'secret')
+        for i in range(5):
+            client.release_connection(BrokenConnection('api.twitter.com', 1))
+        Connection.instances = []
+        with self.assertRaises(twitter.TwitterError):
+            client.request_token()
+        self.assertEqual(len(Connection.instances), 0)
+        self.assertEqual(client.connections.qsize(), 4)
+        self.assertEqual(cache.get(client.breaker.failures_key), 1)
+ClientTest = skipIf(twitter is None, "twitter not installed")(ClientTest)
+
+
+class TokenPoolTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_pool(self):
+        pool = RequestTokenPool('key')
+        self.assertIsNone(pool.pop())
+        pool.push('a', 'secret a')
+        pool.push('b', 'secret b')
+        pool.push('c', 'secret c')
+        self.assertEqual(len(pool), 3)
+        self.assertEqual(pool.pop(), ('a', 'secret a'))
+
+        cache.delete(pool.get_cache_key(2))  # Expired
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.pop(), ('c', 'secret c'))
+        self.assertIsNone(pool.pop())
+        self.assertEqual(len(RequestTokenPool('other key')), 0)
+
+    def test_evicted_head(self):
+        pool = RequestTokenPool('key', size=2)
+        for i in range(50):
+            pool.push('token %d' % i, 'secret')
+        cache.delete(pool.get_cache_key('head'))
+        self.assertEqual(len(pool), 2)
+        # The expired slots before the last two are skipped at once
+        self.assertEqual(pool.pop(), ('token 48', 'secret'))
+        self.assertEqual(pool.bounds(), (49, 50))
+
+        cache.delete(pool.get_cache_key(50))  # Expired
+        self.assertIsNone(pool.pop())
+        self.assertEqual(pool.bounds(), (50, 50))
+TokenPoolTest = skipIf(twitter is None, "twitter not installed")(
+    TokenPoolTest)
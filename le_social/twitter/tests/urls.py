@@ -1,10 +1,19 @@
-from django.conf.urls import patterns, url
+import django
+
+from django.conf.urls import url
 
 from . import views
 
 
-urlpatterns = patterns(
-    '',
+urlpatterns = [
     url(r'^oauth/authorize/$', views.authorize, name='authorize'),
     url(r'^oauth/callback/$', views.callback, name='callback'),
-)
+]
+
+if django.VERSION >= (3, 1):
+    urlpatterns += [
+        url(r'^async/oauth/authorize/$', views.async_authorize,
+            name='async_authorize'),
+        url(r'^async/oauth/callback/$', views.async_callback,
+            name='async_callback'),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import django
 import twitter
 
 from django.http import HttpResponse
@@ -9,7 +10,11 @@ from .. import views
 kwargs = {'consumer_key': 'key',
           'consumer_secret': 'secret'}
 
-authorize = views.Authorize.as_view(**kwargs)
+
+class Authorize(views.Authorize):
+    consumer_key = 'key'
+    consumer_secret = 'secret'
+authorize = Authorize.as_view()
 
 
 class Callback(views.Callback):
@@ -21,3 +26,13 @@ class Callback(views.Callback):
         user = api.account.verify_credentials()
         return HttpResponse(user['screen_name'])
 callback = Callback.as_view(**kwargs)
+
+
+if django.VERSION >= (3, 1):
+    from .. import async_views
+
+    async_authorize = async_views.Authorize.as_view(**kwargs)
+
+    class AsyncCallback(Callback, async_views.Callback):
+        pass
+    async_callback = AsyncCallback.as_view(**kwargs)
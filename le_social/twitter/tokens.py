@@ -0,0 +1,81 @@
+from hashlib import md5
+
+from django.utils.encoding import force_bytes
+
+from ..utils import CacheMixin
+
+
+class RequestTokenPool(CacheMixin):
+    """
+    A queue of request tokens fetched ahead of time, kept in Django's cache
+    so that every process shares it. Tokens expire from the pool after
+    ``ttl`` seconds and each token is handed out once.
+
+    The queue is made of numbered slots between two counters: ``push()``
+    increments the tail and ``pop()`` the head, both atomically. The pool
+    holds at most ``size`` tokens and they expire in order, so only the
+    last ``size`` slots are ever looked at.
+    """
+    key_prefix = 'le_social.twitter.tokens'
+
+    def __init__(self, consumer_key, ttl=600, cache_alias='default',
+                 size=20):
+        self.name = md5(force_bytes(consumer_key)).hexdigest()
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.size = size
+
+    def get_cache_key(self, suffix):
+        return '%s:%s:%s' % (self.key_prefix, self.name, suffix)
+
+    def incr(self, suffix):
+        key = self.get_cache_key(suffix)
+        self.cache.add(key, 0, None)
+        try:
+            return self.cache.incr(key)
+        except ValueError:  # Evicted in the meantime
+            self.cache.set(key, 1, None)
+            return 1
+
+    def bounds(self):
+        keys = [self.get_cache_key('head'), self.get_cache_key('tail')]
+        values = self.cache.get_many(keys)
+        return values.get(keys[0], 0), values.get(keys[1], 0)
+
+    def __len__(self):
+        """
+        Number of unexpired tokens in the pool.
+        """
+        head, tail = self.bounds()
+        head = max(head, tail - self.size)
+        slots = [self.get_cache_key(i) for i in range(head + 1, tail + 1)]
+        return len(self.cache.get_many(slots)) if slots else 0
+
+    def push(self, token, token_secret):
+        head, tail = self.bounds()
+        if tail < head:
+            # More pops than tokens, start again after the head
+            self.cache.set(self.get_cache_key('tail'), head, None)
+        slot = self.get_cache_key(self.incr('tail'))
+        self.cache.set(slot, (token, token_secret), self.ttl)
+
+    def pop(self):
+        """
+        Returns a (token, token_secret) tuple or None if the pool is empty.
+        At most ``size`` expired slots are skipped.
+        """
+        head, tail = self.bounds()
+        if tail - head > self.size:
+            # Older slots have expired, or the head counter was evicted
+            self.cache.set(self.get_cache_key('head'), tail - self.size,
+                           None)
+        for i in range(self.size):
+            if head >= tail:
+                return None
+            slot = self.get_cache_key(self.incr('head'))
+            token = self.cache.get(slot)
+            if token is not None:
+                self.cache.delete(slot)
+                return tuple(token)
+            head, tail = self.bounds()
+        return None
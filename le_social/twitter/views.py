@@ -1,22 +1,57 @@
 from __future__ import absolute_import
 
+from hashlib import md5
+
 from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ImproperlyConfigured
 from django.shortcuts import redirect
+from django.utils.encoding import force_bytes
 from django.views import generic
 
 try:
-    from twitter import Twitter, OAuth, TwitterError
-    from twitter.oauth_dance import parse_oauth_tokens
+    from twitter import TwitterError
 except ImportError:
     raise ImproperlyConfigured(
         "twitter<1.8 is required to use le_social.twitter."
     )
 
+from ..ratelimit import RateLimitMixin
+from ..utils import timed
+from .client import get_client
+from .signals import twitter_timing
+from .tokens import RequestTokenPool
+
+
+class timed_call(timed):
+    """
+    Times a request to Twitter, see ``twitter_timing``. On failure, reports
+    the status of the ``TwitterError`` and ``error``, the message passed to
+    the view's ``error()``.
+    """
+    def __init__(self, sender, phase, error):
+        super(timed_call, self).__init__(twitter_timing, sender, phase=phase,
+                                         status=200, error=None)
+        self.error = error
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None:
+            self.kwargs.update(status=getattr(exc_value, 'status', None),
+                               error=self.error)
+        return super(timed_call, self).__exit__(exc_type, exc_value,
+                                                traceback)
+
 
 class OAuthMixin(object):
     consumer_key = None
     consumer_secret = None
+    timeout = 10
+    failure_threshold = 5
+    recovery_timeout = 30
+    use_token_cookie = False
+    token_cookie_name = 'twitter_request_token'
+    token_cookie_max_age = 60 * 10
+    token_cookie_cache_alias = 'default'
 
     def get_consumer_key(self):
         if self.consumer_key is not None:
@@ -38,31 +73,142 @@ class OAuthMixin(object):
                                        "consumer_secret attribute or "
                                        "implement get_consumer_secret")
 
+    def get_client_options(self):
+        return {
+            'timeout': self.timeout,
+            'failure_threshold': self.failure_threshold,
+            'recovery_timeout': self.recovery_timeout,
+        }
+
+    @property
+    def token_cookie_cache(self):
+        return caches[self.token_cookie_cache_alias]
+
+    def get_token_cache_key(self, token):
+        return 'le_social.twitter.request_token:%s' % md5(
+            force_bytes(token)).hexdigest()
+
+    def save_request_token(self, response, token, token_secret):
+        """
+        Keeps the request token until the user comes back from Twitter: in
+        the session, or in a signed cookie with the secret in the cache when
+        use_token_cookie is set.
+        """
+        if not self.use_token_cookie:
+            self.request.session['request_token'] = (token, token_secret)
+            return
+        self.token_cookie_cache.set(self.get_token_cache_key(token),
+                                    token_secret, self.token_cookie_max_age)
+        response.set_signed_cookie(
+            self.token_cookie_name, token, salt='le_social.twitter',
+            max_age=self.token_cookie_max_age, httponly=True,
+            secure=self.request.is_secure(),
+        )
+
+    def pop_request_token(self):
+        """
+        Returns the (token, token_secret) tuple saved by
+        save_request_token(), or None. A token can only be used once.
+        """
+        if not self.use_token_cookie:
+            if 'request_token' not in self.request.session:
+                return None
+            request_token = self.request.session.pop('request_token')
+            self.request.session.modified = True
+            return request_token
+        token = self.request.get_signed_cookie(
+            self.token_cookie_name, None, salt='le_social.twitter',
+            max_age=self.token_cookie_max_age)
+        if token is None or token != self.request.GET.get('oauth_token'):
+            return None
+        key = self.get_token_cache_key(token)
+        token_secret = self.token_cookie_cache.get(key)
+        if token_secret is None:
+            return None
+        self.token_cookie_cache.delete(key)
+        return token, token_secret
 
-class Authorize(generic.View, OAuthMixin):
+    def get_client(self):
+        """
+        Returns the process-wide client for the consumer credentials, its
+        connections to Twitter are reused across requests.
+        """
+        return get_client(self.get_consumer_key(), self.get_consumer_secret(),
+                          **self.get_client_options())
+
+
+class Authorize(generic.View, OAuthMixin, RateLimitMixin):
     """
     A base class for the authorize view. Just sets the request token
     in the session and redirects to twitter.
     """
+    use_token_pool = False
+    token_pool_size = 20
+    token_pool_ttl = 60 * 10
+    token_pool_cache_alias = 'default'
+
     def get(self, request, force_login=False, *args, **kwargs):
+        if self.rate_limited():
+            return self.rate_limit_exceeded()
         callback = self.build_callback()
-        oauth = OAuth('', '',
-                      self.get_consumer_key(),
-                      self.get_consumer_secret())
-        api = Twitter(auth=oauth, secure=True, format='', api_version=None)
-        (oauth.token, oauth.token_secret) = parse_oauth_tokens(
-            api.oauth.request_token(oauth_callback=callback))
-        request.session['request_token'] = (oauth.token, oauth.token_secret)
+        request_token = None
+        if callback is None and self.use_token_pool:
+            request_token = self.get_token_pool().pop()
+        if request_token is None:
+            message = 'Failed to get a request token'
+            try:
+                with timed_call(self.__class__, 'request_token', message):
+                    request_token = self.get_request_token(callback)
+            except TwitterError as e:
+                return self.error(message, e)
+        token, token_secret = request_token
         url = ('https://api.twitter.com/oauth/authenticate?oauth_token='
-               '%s' % oauth.token)
+               '%s' % token)
         if force_login:
             url += '&force_login=true'
-        return redirect(url)
+        response = redirect(url)
+        self.save_request_token(response, token, token_secret)
+        return response
+
+    def get_request_token(self, callback):
+        """
+        Fetches a request token from Twitter, returns a (token, secret)
+        tuple.
+        """
+        return self.get_client().request_token(callback)
+
+    def get_token_pool(self):
+        return RequestTokenPool(self.get_consumer_key(), self.token_pool_ttl,
+                                self.token_pool_cache_alias,
+                                self.token_pool_size)
+
+    def fill_token_pool(self, size=None):
+        """
+        Fetches request tokens until the pool holds ``size`` tokens (by
+        default ``token_pool_size``). Returns the number of tokens added.
+        """
+        if size is None:
+            size = self.token_pool_size
+        pool = self.get_token_pool()
+        added = 0
+        for i in range(size - len(pool)):
+            with timed_call(self.__class__, 'request_token',
+                            'Failed to get a request token'):
+                request_token = self.get_request_token(None)
+            pool.push(*request_token)
+            added += 1
+        return added
 
     def build_callback(self):
         """ Override this if you'd like to specify a callback URL"""
         return None
 
+    def error(self, message, exception=None):
+        """
+        Twitter couldn't be reached. Re-raises the exception by default.
+        """
+        raise exception
+
 
 class Callback(generic.View, OAuthMixin):
     """
@@ -76,28 +222,43 @@ class Callback(generic.View, OAuthMixin):
           an HttpResponse
     """
     def get(self, request, *args, **kwargs):
+        response = self.complete(request)
+        if self.use_token_cookie:
+            # The request token is only used once, whatever the outcome
+            response.delete_cookie(self.token_cookie_name)
+        return response
+
+    def complete(self, request):
+        """
+        Exchanges the request token for an access token and returns the
+        response of success() or error().
+        """
         verifier = request.GET.get('oauth_verifier', None)
         if verifier is None:
             return self.error('No verifier code')
 
-        if 'request_token' not in request.session:
+        request_token = self.pop_request_token()
+        if request_token is None:
+            if self.use_token_cookie:
+                return self.error('No valid request token found')
             return self.error('No request token found in the session')
 
-        request_token = request.session.pop('request_token')
-        request.session.modified = True
-
-        oauth = OAuth(request_token[0], request_token[1],
-                      self.get_consumer_key(),
-                      self.get_consumer_secret())
-        api = Twitter(auth=oauth, secure=True, format='', api_version=None)
+        message = 'Failed to get an access token'
         try:
-            (oauth.token, oauth.token_secret) = parse_oauth_tokens(
-                api.oauth.access_token(oauth_verifier=verifier))
-        except TwitterError:
-            return self.error('Failed to get an access token')
-
+            with timed_call(self.__class__, 'access_token', message):
+                oauth = self.get_access_token(request_token, verifier)
+        except TwitterError as e:
+            return self.error(message, e)
         return self.success(oauth)
 
+    def get_access_token(self, request_token, verifier):
+        """
+        Exchanges the request token for an access token, returns a
+        twitter.OAuth object.
+        """
+        return self.get_client().access_token(request_token[0],
+                                              request_token[1], verifier)
+
     def success(self, auth):
         """
         Twitter authentication successful, do some stuff with his key.
@@ -1,5 +1,97 @@
+import time
+
+try:
+    from time import perf_counter as timer
+except ImportError:  # Python 2
+    from time import time as timer
+
+from django.core.cache import caches
+
 try:
     from django.contrib.auth import get_user_model
 except ImportError:
     from django.contrib.auth.models import User
     get_user_model = lambda: User  # noqa
+
+
+class CacheMixin(object):
+    """
+    Gives access to the cache named ``cache_alias``.
+    """
+    cache_alias = 'default'
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+
+def in_batches(queryset, batch_size=1000, sleep=0):
+    """
+    Splits ``queryset`` in primary key ranges of at most ``batch_size`` rows
+    and yields a ``(queryset, count)`` tuple for each range, sleeping
+    ``sleep`` seconds between two batches so that locks are released
+    regularly. The ranges are computed lazily, the rows of a batch can be
+    updated or deleted before the next one is fetched.
+    """
+    queryset = queryset.order_by('pk')
+    remaining = queryset
+    while True:
+        pks = list(remaining.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield queryset.filter(pk__range=(pks[0], pks[-1])), len(pks)
+        if len(pks) < batch_size:
+            return
+        remaining = queryset.filter(pk__gt=pks[-1])
+        if sleep:
+            time.sleep(sleep)
+
+
+def delete_in_batches(queryset, batch_size=1000, sleep=0):
+    """
+    Deletes the rows matched by ``queryset`` in batches, see
+    ``in_batches()``. Returns the number of deleted rows.
+    """
+    deleted = 0
+    for batch, count in in_batches(queryset, batch_size, sleep):
+        batch.delete()
+        deleted += count
+    return deleted
+
+
+def update_in_batches(queryset, values, batch_size=1000, sleep=0):
+    """
+    Updates the rows matched by ``queryset`` with ``values`` in batches, see
+    ``in_batches()``. Returns the number of updated rows.
+    """
+    updated = 0
+    for batch, count in in_batches(queryset, batch_size, sleep):
+        updated += batch.update(**values)
+    return updated
+
+
+class timed(object):
+    """
+    Context manager sending ``signal`` with the ``duration`` of its block, in
+    seconds, and an ``outcome``. The outcome can be set on the context
+    manager from within the block, it defaults to 'failure' if the block
+    raises and 'success' otherwise. Other arguments of the signal can be
+    updated in ``kwargs``.
+    """
+    def __init__(self, signal, sender, **kwargs):
+        self.signal = signal
+        self.sender = sender
+        self.kwargs = kwargs
+        self.outcome = None
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = timer() - self.start
+        outcome = self.outcome
+        if outcome is None:
+            outcome = 'success' if exc_type is None else 'failure'
+        self.signal.send(sender=self.sender, duration=duration,
+                         outcome=outcome, **self.kwargs)